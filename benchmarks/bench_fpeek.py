@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+fpeek benchmark suite
+
+Generates reproducible synthetic trees and times the headless hot paths:
+metadata, hashing, directory walks, archive generation and graph rendering.
+Each benchmark runs in its own interpreter so the reported peak RSS
+belongs to that benchmark alone.
+
+    python3 benchmarks/bench_fpeek.py                  # run everything
+    python3 benchmarks/bench_fpeek.py --scale 0.1      # quick smoke run
+    python3 benchmarks/bench_fpeek.py --only hash,walk --json results.json
+
+Trees are cached under --root and reused while their parameters match.
+The metadata cache is disabled unless --cache is given, so every run
+measures the cold code paths (the OS page cache stays warm either way).
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+TREE_VERSION = 1
+SEED = 1234
+
+SMALL_FILES = 5000
+SMALL_FILES_PER_DIR = 250
+SMALL_FILE_MAX = 16 * 1024
+HUGE_FILES = 2
+HUGE_FILE_SIZE = 256 * 1024 * 1024
+DEEP_DEPTH = 64
+DEEP_FILES_PER_LEVEL = 8
+MEDIA_SECONDS = 60
+IMAGE_SIZE = 2048
+
+WRITE_BLOCK = 1024 * 1024
+
+
+def _random_bytes(rng, n):
+    # Random.randbytes() needs Python 3.9
+    return rng.getrandbits(n * 8).to_bytes(n, 'little') if n else b''
+
+
+def _write_random(path, size, rng):
+    with open(path, 'wb') as f:
+        block = _random_bytes(rng, min(size, WRITE_BLOCK))
+        remaining = size
+        while remaining > 0:
+            chunk = block[:remaining]
+            f.write(chunk)
+            remaining -= len(chunk)
+
+
+def make_small_tree(root, scale, rng):
+    count = max(1, int(SMALL_FILES * scale))
+    for i in range(count):
+        subdir = os.path.join(root, f"d{i // SMALL_FILES_PER_DIR:03d}")
+        os.makedirs(subdir, exist_ok=True)
+        _write_random(os.path.join(subdir, f"f{i:06d}.bin"), rng.randint(0, SMALL_FILE_MAX), rng)
+
+
+def make_huge_tree(root, scale, rng):
+    os.makedirs(root, exist_ok=True)
+    for i in range(HUGE_FILES):
+        _write_random(os.path.join(root, f"huge{i}.bin"), max(1, int(HUGE_FILE_SIZE * scale)), rng)
+
+
+def make_deep_tree(root, scale, rng):
+    path = root
+    for level in range(max(1, int(DEEP_DEPTH * scale))):
+        path = os.path.join(path, f"level{level:03d}")
+        os.makedirs(path, exist_ok=True)
+        for i in range(DEEP_FILES_PER_LEVEL):
+            _write_random(os.path.join(path, f"f{i}.txt"), rng.randint(0, 4096), rng)
+
+
+def make_media_tree(root, scale, rng):
+    """Media samples via ffmpeg when available; the image falls back to Pillow."""
+    os.makedirs(root, exist_ok=True)
+    seconds = max(1, int(MEDIA_SECONDS * scale))
+    size = max(64, int(IMAGE_SIZE * scale ** 0.5))
+
+    if shutil.which('ffmpeg'):
+        jobs = [
+            ['-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}', 'tone.wav'],
+            ['-f', 'lavfi', '-i', f'anoisesrc=duration={seconds}:seed={SEED}', 'noise.flac'],
+            ['-f', 'lavfi', '-i', f'testsrc=duration={seconds}:size=640x360:rate=25',
+             '-f', 'lavfi', '-i', f'sine=frequency=1000:duration={seconds}',
+             '-shortest', 'clip.mp4'],
+            ['-f', 'lavfi', '-i', f'mandelbrot=size={size}x{size}', '-frames:v', '1', 'image.png'],
+        ]
+        for args in jobs:
+            subprocess.run(
+                ['ffmpeg', '-v', 'error', '-y', *args[:-1], os.path.join(root, args[-1])],
+                check=True
+            )
+        return
+
+    try:
+        from PIL import Image
+    except ImportError:
+        return
+    Image.frombytes('RGB', (size, size), _random_bytes(rng, size * size * 3)).save(
+        os.path.join(root, 'image.png')
+    )
+
+
+TREES = {
+    'small': make_small_tree,
+    'huge': make_huge_tree,
+    'deep': make_deep_tree,
+    'media': make_media_tree,
+}
+
+
+def prepare_trees(root, scale):
+    """Create the synthetic trees under root unless a matching set exists."""
+    params = {'version': TREE_VERSION, 'seed': SEED, 'scale': scale}
+    marker = os.path.join(root, 'params.json')
+    try:
+        with open(marker) as f:
+            if json.load(f) == params:
+                return
+    except (OSError, ValueError):
+        pass
+
+    for name, make in TREES.items():
+        path = os.path.join(root, name)
+        shutil.rmtree(path, ignore_errors=True)
+        print(f"generating {name} tree...", file=sys.stderr)
+        make(path, scale, random.Random(f"{SEED}:{name}"))
+
+    with open(marker, 'w') as f:
+        json.dump(params, f)
+
+
+def _files(root):
+    from fpeek_common import walk_tree
+    return [entry.path for entry, is_dir in walk_tree(root) if not is_dir]
+
+
+def _total_size(paths):
+    return sum(os.path.getsize(p) for p in paths)
+
+
+# Each benchmark takes the tree root and returns (files, bytes, seconds)
+
+def bench_metadata(root):
+    from fpeek_common import get_file_metadata
+    paths = _files(os.path.join(root, 'small'))
+    start = time.perf_counter()
+    for path in paths:
+        get_file_metadata(path)
+    return len(paths), _total_size(paths), time.perf_counter() - start
+
+
+def bench_hash(root):
+    from fpeek_common import calculate_hash
+    paths = _files(os.path.join(root, 'huge'))
+    start = time.perf_counter()
+    for path in paths:
+        calculate_hash(path, 'sha256')
+    return len(paths), _total_size(paths), time.perf_counter() - start
+
+
+def bench_hash_small(root):
+    from fpeek_common import calculate_hashes
+    paths = _files(os.path.join(root, 'small'))
+    start = time.perf_counter()
+    for path in paths:
+        calculate_hashes(path)
+    return len(paths), _total_size(paths), time.perf_counter() - start
+
+
+def bench_walk(root):
+    from fpeek_common import directory_totals
+    start = time.perf_counter()
+    files, size = 0, 0
+    for name in ('small', 'deep'):
+        tree_files, _, tree_size = directory_totals(os.path.join(root, name))
+        files += tree_files
+        size += tree_size
+    return files, size, time.perf_counter() - start
+
+
+def bench_archive(root):
+    from fpeek_common import write_directory_archive
+    dirpath = os.path.join(root, 'small')
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        summary = write_directory_archive(dirpath, os.path.join(tmp, 'archive.jsonl.gz'),
+                                          compression='gzip')
+        elapsed = time.perf_counter() - start
+    return summary['total_files'], summary['total_size_bytes'], elapsed
+
+
+def bench_duplicates(root):
+    from fpeek_common import find_duplicates
+    dirpath = os.path.join(root, 'small')
+    start = time.perf_counter()
+    find_duplicates(dirpath)
+    elapsed = time.perf_counter() - start
+    paths = _files(dirpath)
+    return len(paths), _total_size(paths), elapsed
+
+
+def bench_graph(root):
+    from fpeek_common import get_mime_type
+    from fpeek_signal import graph_kind, render_graph
+    paths = [p for p in _files(os.path.join(root, 'media')) if graph_kind(get_mime_type(p))]
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        for i, path in enumerate(paths):
+            render_graph(path, graph_kind(get_mime_type(path)), os.path.join(tmp, f"{i}.png"))
+        elapsed = time.perf_counter() - start
+    return len(paths), _total_size(paths), elapsed
+
+
+BENCHMARKS = {
+    'metadata': bench_metadata,
+    'hash': bench_hash,
+    'hash_small': bench_hash_small,
+    'walk': bench_walk,
+    'archive': bench_archive,
+    'duplicates': bench_duplicates,
+    'graph': bench_graph,
+}
+
+
+def peak_rss_kb():
+    # ru_maxrss is in KiB on Linux; children covers ffmpeg/ffprobe
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+
+def run_worker(name, root, repeat):
+    """Run one benchmark in this process and print its result as JSON."""
+    best = None
+    for _ in range(repeat):
+        files, nbytes, seconds = BENCHMARKS[name](root)
+        if best is None or seconds < best[2]:
+            best = (files, nbytes, seconds)
+    files, nbytes, seconds = best
+    print(json.dumps({
+        'name': name,
+        'files': files,
+        'bytes': nbytes,
+        'seconds': seconds,
+        'files_per_s': files / seconds if seconds else None,
+        'mb_per_s': nbytes / seconds / (1024 * 1024) if seconds else None,
+        'peak_rss_kb': peak_rss_kb(),
+    }))
+
+
+def run_benchmark(name, root, repeat, env):
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', name,
+         '--root', root, '--repeat', str(repeat)],
+        env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()
+        return {'name': name, 'error': error[-1] if error else f"exit {proc.returncode}"}
+    return json.loads(proc.stdout)
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', '-C', REPO_DIR, 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results):
+    print(f"{'benchmark':<12} {'files':>8} {'MB':>9} {'seconds':>9} "
+          f"{'files/s':>10} {'MB/s':>9} {'peak RSS':>10}")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['name']:<12} error: {r['error']}")
+            continue
+        print(f"{r['name']:<12} {r['files']:>8} {r['bytes'] / (1024 * 1024):>9.1f} "
+              f"{r['seconds']:>9.3f} {r['files_per_s'] or 0:>10.1f} {r['mb_per_s'] or 0:>9.1f} "
+              f"{r['peak_rss_kb'] / 1024:>8.1f}MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark fpeek hot paths.')
+    parser.add_argument('--root', default=os.path.join(tempfile.gettempdir(), 'fpeek-bench'),
+                        help='where synthetic trees are generated (default: %(default)s)')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply tree sizes by this factor (default: %(default)s)')
+    parser.add_argument('--only', help='comma-separated benchmarks: ' + ','.join(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per benchmark; the fastest is reported (default: %(default)s)')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep the persistent metadata cache enabled')
+    parser.add_argument('--json', metavar='FILE', help='also write results to FILE')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        run_worker(args.worker, args.root, max(1, args.repeat))
+        return 0
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+
+    os.makedirs(args.root, exist_ok=True)
+    prepare_trees(args.root, args.scale)
+
+    env = dict(os.environ)
+    if not args.cache:
+        env['FPEEK_NO_CACHE'] = '1'
+
+    results = [run_benchmark(name, args.root, max(1, args.repeat), env) for name in names]
+    print_table(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'revision': _git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'scale': args.scale,
+                'cache': args.cache,
+                'results': results,
+            }, f, indent=2)
+    return 0 if all('error' not in r for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,7 +9,30 @@ import json
 from datetime import datetime
 import subprocess
 import tempfile
-from fpeek_common import get_file_metadata, calculate_hash, get_media_metadata, format_size
+from fpeek_cache import get_graph_cache
+from fpeek_trace import span, collect
+from fpeek_common import (
+    get_file_metadata, calculate_hashes, get_media_metadata, format_size,
+    write_directory_archive, directory_totals, DEFAULT_JOBS, ARCHIVE_EXTENSIONS,
+    Task, TaskCancelled, run_in_background, find_duplicates,
+    summarize_selection, write_selection_archive, selection_base,
+    find_previous_archive, open_baseline,
+)
+
+ARCHIVE_JOBS = int(os.environ.get('FPEEK_JOBS', DEFAULT_JOBS))
+# Directory archives are streamed as JSON Lines: gzip, zstd or none
+ARCHIVE_COMPRESSION = os.environ.get('FPEEK_ARCHIVE_COMPRESSION', 'gzip')
+if ARCHIVE_COMPRESSION == 'none':
+    ARCHIVE_COMPRESSION = None
+# incremental: reuse the previous archive's records for unchanged files,
+# delta: write only changes against it, full: always re-hash everything
+ARCHIVE_MODE = os.environ.get('FPEEK_ARCHIVE_MODE', 'incremental')
+DUPLICATE_DISPLAY_LIMIT = 200
+# Perceptual hash bits two images may differ in and still count as similar
+SIMILAR_MAX_DISTANCE = int(os.environ.get('FPEEK_SIMILAR_DISTANCE', 8))
+# Decode large JPEGs at full size for exact histogram counts
+GRAPH_EXACT = os.environ.get('FPEEK_GRAPH_EXACT', '0') not in ('', '0')
+SELECTION_TYPES_SHOWN = 20
 
 
 class FpeekAnalysisExtension(GObject.GObject, Nautilus.MenuProvider):
@@ -17,9 +40,26 @@ class FpeekAnalysisExtension(GObject.GObject, Nautilus.MenuProvider):
         super().__init__()
 
     def get_file_items(self, files):
-        if len(files) != 1:
+        if not files:
             return []
 
+        if len(files) > 1:
+            item = Nautilus.MenuItem(
+                name='FpeekAnalysisExtension::SelectionAnalysis',
+                label=f'Full Analysis ({len(files)} items)',
+                tip='Combined analysis of all selected files and directories'
+            )
+            item.connect('activate', self.on_selection_analysis_click, files)
+
+            archive_item = Nautilus.MenuItem(
+                name='FpeekAnalysisExtension::ArchiveSelection',
+                label='Archive Selection',
+                tip='Write one metadata and checksum archive for the selection'
+            )
+            archive_item.connect('activate', lambda menu: self.on_generate_selection_archive(
+                self.selection_paths(files)))
+            return [item, archive_item]
+
         file_info = files[0]
 
         item = Nautilus.MenuItem(
@@ -28,8 +68,26 @@ class FpeekAnalysisExtension(GObject.GObject, Nautilus.MenuProvider):
             tip='Detailed analysis with graphs and archive options'
         )
         item.connect('activate', self.on_analysis_click, file_info)
-
-        return [item]
+        items = [item]
+
+        if file_info.is_directory():
+            dup_item = Nautilus.MenuItem(
+                name='FpeekAnalysisExtension::FindDuplicates',
+                label='Find Duplicates',
+                tip='Find files with identical content in this directory'
+            )
+            dup_item.connect('activate', self.on_duplicates_click, file_info)
+            items.append(dup_item)
+
+            similar_item = Nautilus.MenuItem(
+                name='FpeekAnalysisExtension::FindSimilarImages',
+                label='Find Similar Images',
+                tip='Find resized or recompressed copies of images in this directory'
+            )
+            similar_item.connect('activate', self.on_similar_images_click, file_info)
+            items.append(similar_item)
+
+        return items
 
     def on_analysis_click(self, menu, file_info):
         file_path = file_info.get_location().get_path()
@@ -53,9 +111,56 @@ class FpeekAnalysisExtension(GObject.GObject, Nautilus.MenuProvider):
         main_box.set_margin_top(20)
         main_box.set_margin_bottom(20)
 
-        metadata = get_file_metadata(filepath)
-        media_info = get_media_metadata(filepath)
+        label = Gtk.Label(label="Analyzing...")
+        label.set_selectable(True)
+        label.set_wrap(True)
+        label.set_xalign(0)
+
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_child(label)
+        scrolled.set_vexpand(True)
+        main_box.append(scrolled)
+
+        status_label = Gtk.Label()
+        status_label.set_xalign(0)
+        main_box.append(status_label)
+
+        button_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        button_box.set_halign(Gtk.Align.END)
+
+        cancel_btn = Gtk.Button(label="Cancel")
+        button_box.append(cancel_btn)
+
+        graph_btn = Gtk.Button(label="Generate Graph")
+        graph_btn.connect('clicked', lambda w: self.on_generate_graph(filepath))
+        button_box.append(graph_btn)
+
+        archive_btn = Gtk.Button(label="Generate Archive")
+        archive_btn.connect('clicked', lambda w: self.on_generate_archive(filepath))
+        button_box.append(archive_btn)
+
+        close_btn = Gtk.Button(label="Close")
+        close_btn.connect('clicked', lambda w: dialog.close())
+        button_box.append(close_btn)
+
+        main_box.append(button_box)
+        dialog.set_child(main_box)
+
+        def work(task):
+            with collect(f"analysis {filepath}"):
+                metadata = get_file_metadata(filepath)
+                return metadata, get_media_metadata(filepath, task, metadata['mime_type'])
+
+        def on_done(result, error):
+            if error is None:
+                label.set_markup(self.format_file_analysis(*result))
+            else:
+                label.set_text(self.describe_error(error))
+
+        self.start_task(dialog, work, on_done, status_label, cancel_btn)
+        dialog.present()
 
+    def format_file_analysis(self, metadata, media_info):
         content = f"<b>File:</b> {metadata['filename']}\n"
         content += f"<b>Path:</b> {metadata['filepath']}\n"
         content += f"<b>Size:</b> {metadata['size_human']} ({metadata['size_bytes']} bytes)\n"
@@ -94,8 +199,20 @@ class FpeekAnalysisExtension(GObject.GObject, Nautilus.MenuProvider):
                     if 'channels' in stream:
                         content += f"<b>Channels:</b> {stream['channels']}\n"
 
-        label = Gtk.Label()
-        label.set_markup(content)
+        return content
+
+    def show_directory_analysis(self, dirpath):
+        dialog = Gtk.Window()
+        dialog.set_title("Directory Analysis")
+        dialog.set_default_size(600, 500)
+
+        main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
+        main_box.set_margin_start(20)
+        main_box.set_margin_end(20)
+        main_box.set_margin_top(20)
+        main_box.set_margin_bottom(20)
+
+        label = Gtk.Label(label="Scanning directory...")
         label.set_selectable(True)
         label.set_wrap(True)
         label.set_xalign(0)
@@ -105,15 +222,18 @@ class FpeekAnalysisExtension(GObject.GObject, Nautilus.MenuProvider):
         scrolled.set_vexpand(True)
         main_box.append(scrolled)
 
+        status_label = Gtk.Label()
+        status_label.set_xalign(0)
+        main_box.append(status_label)
+
         button_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
         button_box.set_halign(Gtk.Align.END)
 
-        graph_btn = Gtk.Button(label="Generate Graph")
-        graph_btn.connect('clicked', lambda w: self.on_generate_graph(filepath))
-        button_box.append(graph_btn)
+        cancel_btn = Gtk.Button(label="Cancel")
+        button_box.append(cancel_btn)
 
         archive_btn = Gtk.Button(label="Generate Archive")
-        archive_btn.connect('clicked', lambda w: self.on_generate_archive(filepath))
+        archive_btn.connect('clicked', lambda w: self.on_generate_archive(dirpath))
         button_box.append(archive_btn)
 
         close_btn = Gtk.Button(label="Close")
@@ -122,12 +242,121 @@ class FpeekAnalysisExtension(GObject.GObject, Nautilus.MenuProvider):
 
         main_box.append(button_box)
         dialog.set_child(main_box)
+
+        def on_done(result, error):
+            if error is not None:
+                label.set_text(self.describe_error(error))
+                return
+
+            total_files, total_dirs, total_size = result
+            content = f"<b>Directory:</b> {os.path.basename(dirpath)}\n"
+            content += f"<b>Path:</b> {dirpath}\n\n"
+            content += f"<b>Total Files:</b> {total_files}\n"
+            content += f"<b>Total Subdirectories:</b> {total_dirs}\n"
+            content += f"<b>Total Size:</b> {format_size(total_size)}\n"
+            label.set_markup(content)
+
+        def work(task):
+            with collect(f"directory analysis {dirpath}"):
+                return directory_totals(dirpath, task=task)
+
+        self.start_task(dialog, work, on_done, status_label, cancel_btn)
         dialog.present()
 
-    def show_directory_analysis(self, dirpath):
+    def selection_paths(self, files):
+        paths = [f.get_location().get_path() for f in files]
+        return [p for p in paths if p and os.path.exists(p)]
+
+    def selection_archive_dir(self, paths):
+        """Where a selection's archive goes: the selection's common base if
+        writable (search results can share only `/`), else the first item's
+        parent directory, else the home directory."""
+        for candidate in (selection_base(paths), os.path.dirname(os.path.abspath(paths[0]))):
+            if os.access(candidate, os.W_OK):
+                return candidate
+        return os.path.expanduser('~')
+
+    def on_selection_analysis_click(self, menu, files):
+        paths = self.selection_paths(files)
+        if paths:
+            self.show_selection_analysis(paths)
+
+    def show_selection_analysis(self, paths):
+        self.show_search_results(
+            "Selection Analysis", f"Analysing {len(paths)} items...",
+            lambda task: summarize_selection(paths, ARCHIVE_JOBS, task=task),
+            lambda summary: self.format_selection(paths, summary),
+            buttons=[("Generate Archive", lambda: self.on_generate_selection_archive(paths))],
+            size=(600, 500)
+        )
+
+    def format_selection(self, paths, summary):
+        content = f"<b>Selection:</b> {summary['items']} items in "
+        content += f"{GLib.markup_escape_text(selection_base(paths))}\n\n"
+        content += f"<b>Total Files:</b> {summary['files']}\n"
+        content += f"<b>Total Subdirectories:</b> {summary['directories']}\n"
+        content += f"<b>Total Size:</b> {format_size(summary['total_size'])}\n"
+        if summary['unreadable']:
+            content += f"<b>Unreadable:</b> {summary['unreadable']}\n"
+
+        if summary['media_files']:
+            duration = summary['media_duration']
+            content += "\n<b>Media:</b>\n"
+            content += f"  Files: {summary['media_files']}\n"
+            content += f"  Total Duration: {int(duration // 3600)}h {int(duration % 3600 // 60)}m {int(duration % 60)}s\n"
+
+        types = sorted(summary['types'].items(), key=lambda t: t[1]['size'], reverse=True)
+        if types:
+            content += "\n<b>Types:</b>\n"
+            for mime_type, counts in types[:SELECTION_TYPES_SHOWN]:
+                content += f"  {GLib.markup_escape_text(mime_type)}: {counts['count']} files, "
+                content += f"{format_size(counts['size'])}\n"
+            if len(types) > SELECTION_TYPES_SHOWN:
+                content += f"  ... and {len(types) - SELECTION_TYPES_SHOWN} more types\n"
+        return content
+
+    def on_duplicates_click(self, menu, file_info):
+        dirpath = file_info.get_location().get_path()
+
+        if not os.path.isdir(dirpath):
+            return
+
+        self.show_duplicates(dirpath)
+
+    def show_duplicates(self, dirpath):
+        self.show_search_results(
+            "Duplicate Files", "Searching for duplicates...",
+            lambda task: find_duplicates(dirpath, ARCHIVE_JOBS, task=task),
+            lambda duplicates: self.format_duplicates(dirpath, duplicates)
+        )
+
+    def on_similar_images_click(self, menu, file_info):
+        dirpath = file_info.get_location().get_path()
+
+        if not os.path.isdir(dirpath):
+            return
+
+        self.show_similar_images(dirpath)
+
+    def show_similar_images(self, dirpath):
+        def work(task):
+            from fpeek_similar import find_similar_images
+            return find_similar_images(dirpath, SIMILAR_MAX_DISTANCE, ARCHIVE_JOBS, task=task)
+
+        self.show_search_results(
+            "Similar Images", "Fingerprinting images...", work,
+            lambda groups: self.format_similar_images(dirpath, groups)
+        )
+
+    def show_search_results(self, title, searching, work, format_result, buttons=(),
+                            size=(700, 600)):
+        """Window that runs work(task) and shows format_result(result) as markup.
+
+        `buttons` are extra (label, callback) pairs placed before Close.
+        """
         dialog = Gtk.Window()
-        dialog.set_title("Directory Analysis")
-        dialog.set_default_size(600, 500)
+        dialog.set_title(title)
+        dialog.set_default_size(*size)
 
         main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
         main_box.set_margin_start(20)
@@ -135,27 +364,7 @@ class FpeekAnalysisExtension(GObject.GObject, Nautilus.MenuProvider):
         main_box.set_margin_top(20)
         main_box.set_margin_bottom(20)
 
-        total_files = 0
-        total_dirs = 0
-        total_size = 0
-
-        for root, dirs, files in os.walk(dirpath):
-            total_dirs += len(dirs)
-            total_files += len(files)
-            for filename in files:
-                try:
-                    total_size += os.path.getsize(os.path.join(root, filename))
-                except:
-                    pass
-
-        content = f"<b>Directory:</b> {os.path.basename(dirpath)}\n"
-        content += f"<b>Path:</b> {dirpath}\n\n"
-        content += f"<b>Total Files:</b> {total_files}\n"
-        content += f"<b>Total Subdirectories:</b> {total_dirs}\n"
-        content += f"<b>Total Size:</b> {format_size(total_size)}\n"
-
-        label = Gtk.Label()
-        label.set_markup(content)
+        label = Gtk.Label(label=searching)
         label.set_selectable(True)
         label.set_wrap(True)
         label.set_xalign(0)
@@ -165,12 +374,20 @@ class FpeekAnalysisExtension(GObject.GObject, Nautilus.MenuProvider):
         scrolled.set_vexpand(True)
         main_box.append(scrolled)
 
+        status_label = Gtk.Label()
+        status_label.set_xalign(0)
+        main_box.append(status_label)
+
         button_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
         button_box.set_halign(Gtk.Align.END)
 
-        archive_btn = Gtk.Button(label="Generate Archive")
-        archive_btn.connect('clicked', lambda w: self.on_generate_archive(dirpath))
-        button_box.append(archive_btn)
+        cancel_btn = Gtk.Button(label="Cancel")
+        button_box.append(cancel_btn)
+
+        for button_label, callback in buttons:
+            button = Gtk.Button(label=button_label)
+            button.connect('clicked', lambda w, callback=callback: callback())
+            button_box.append(button)
 
         close_btn = Gtk.Button(label="Close")
         close_btn.connect('clicked', lambda w: dialog.close())
@@ -178,169 +395,284 @@ class FpeekAnalysisExtension(GObject.GObject, Nautilus.MenuProvider):
 
         main_box.append(button_box)
         dialog.set_child(main_box)
+
+        def on_done(result, error):
+            if error is None:
+                label.set_markup(format_result(result))
+            else:
+                label.set_text(self.describe_error(error))
+
+        self.start_task(dialog, work, on_done, status_label, cancel_btn)
+        dialog.present()
+
+    def format_duplicates(self, dirpath, duplicates):
+        wasted = sum(d['size'] * (len(d['paths']) - 1) for d in duplicates)
+
+        content = f"<b>Directory:</b> {GLib.markup_escape_text(dirpath)}\n"
+        content += f"<b>Duplicate groups:</b> {len(duplicates)}\n"
+        content += f"<b>Wasted space:</b> {format_size(wasted)}\n"
+
+        for group in duplicates[:DUPLICATE_DISPLAY_LIMIT]:
+            content += f"\n<b>{format_size(group['size'])} x {len(group['paths'])}</b>\n"
+            for path in group['paths']:
+                content += f"  {GLib.markup_escape_text(os.path.relpath(path, dirpath))}\n"
+
+        if len(duplicates) > DUPLICATE_DISPLAY_LIMIT:
+            content += f"\n... and {len(duplicates) - DUPLICATE_DISPLAY_LIMIT} more groups\n"
+        return content
+
+    def format_similar_images(self, dirpath, groups):
+        content = f"<b>Directory:</b> {GLib.markup_escape_text(dirpath)}\n"
+        content += f"<b>Similar image groups:</b> {len(groups)}\n"
+        content += f"<b>Images in groups:</b> {sum(len(g['paths']) for g in groups)}\n"
+
+        for group in groups[:DUPLICATE_DISPLAY_LIMIT]:
+            content += f"\n<b>{len(group['paths'])} images</b>\n"
+            for path, distance in zip(group['paths'], group['distances']):
+                relpath = GLib.markup_escape_text(os.path.relpath(path, dirpath))
+                content += f"  {relpath}" + (f"  ({distance} bits)\n" if distance else "\n")
+
+        if len(groups) > DUPLICATE_DISPLAY_LIMIT:
+            content += f"\n... and {len(groups) - DUPLICATE_DISPLAY_LIMIT} more groups\n"
+        return content
+
+    def describe_error(self, error):
+        if isinstance(error, TaskCancelled):
+            return "Cancelled."
+        return f"Error: {str(error)}"
+
+    def start_task(self, dialog, work, on_done, status_label, cancel_btn):
+        """Run work(task) off the main thread, showing progress in status_label.
+
+        Cancel and closing the dialog both stop the task; on_done runs on the
+        GTK main loop once the worker returns.
+        """
+        task = Task()
+
+        def refresh():
+            if task.done:
+                return False
+            status = f"{task.files_scanned} files scanned"
+            if task.bytes_hashed:
+                status += f", {format_size(task.bytes_hashed)} hashed"
+            status_label.set_text(status)
+            return True
+
+        def finished(result, error):
+            cancel_btn.set_visible(False)
+            status_label.set_visible(False)
+            on_done(result, error)
+
+        def cancel():
+            task.cancel()
+            cancel_btn.set_sensitive(False)
+            status_label.set_text("Cancelling...")
+
+        cancel_btn.connect('clicked', lambda w: cancel())
+        dialog.connect('close-request', lambda w: task.cancel() or False)
+        GLib.timeout_add(250, refresh)
+        run_in_background(work, finished, GLib.idle_add, task)
+        return task
+
+    def run_with_progress(self, title, work, on_result=None):
+        """Run work(task) in the background behind a small progress window.
+
+        on_result(result) is called on the main loop if work succeeds.
+        """
+        dialog = Gtk.Window()
+        dialog.set_title(title)
+        dialog.set_default_size(360, 100)
+
+        main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
+        main_box.set_margin_start(20)
+        main_box.set_margin_end(20)
+        main_box.set_margin_top(20)
+        main_box.set_margin_bottom(20)
+
+        status_label = Gtk.Label(label="Working...")
+        status_label.set_xalign(0)
+        main_box.append(status_label)
+
+        cancel_btn = Gtk.Button(label="Cancel")
+        cancel_btn.set_halign(Gtk.Align.END)
+        main_box.append(cancel_btn)
+
+        def on_done(result, error):
+            dialog.close()
+            if error is None and on_result:
+                on_result(result)
+
+        dialog.set_child(main_box)
+        self.start_task(dialog, work, on_done, status_label, cancel_btn)
         dialog.present()
 
     def on_generate_graph(self, filepath):
+        def on_result(graph_path):
+            if graph_path:
+                self.show_graph(filepath, graph_path)
+
+        self.run_with_progress("Generating Graph", lambda task: self.generate_graph(filepath, task),
+                               on_result)
+
+    def on_generate_selection_archive(self, paths):
+        if paths:
+            self.run_with_progress("Generating Archive",
+                                   lambda task: self.generate_selection_archive(paths, task))
+
+    def on_generate_archive(self, path):
+        self.run_with_progress("Generating Archive", lambda task: self.generate_archive(path, task))
+
+    def generate_graph(self, filepath, task):
+        """Render (or fetch from the graph cache) the graph for filepath.
+
+        Returns the cached PNG path, or None if nothing was rendered.
+        """
         try:
-            import matplotlib
-            matplotlib.use('Agg')
-            import matplotlib.pyplot as plt
-            import numpy as np
-
-            mime_type = get_file_metadata(filepath).get('mime_type', '')
-
-            if mime_type.startswith('image/'):
-                from PIL import Image
-                img = Image.open(filepath)
-                img_array = np.array(img)
-
-                fig, axes = plt.subplots(1, 3, figsize=(12, 4))
-                fig.suptitle('Image Analysis')
-
-                if len(img_array.shape) == 3 and img_array.shape[2] >= 3:
-                    colors = ['red', 'green', 'blue']
-                    for i, (ax, color) in enumerate(zip(axes, colors)):
-                        ax.hist(img_array[:,:,i].ravel(), bins=256, color=color, alpha=0.7)
-                        ax.set_title(f'{color.capitalize()} Channel')
-                        ax.set_xlabel('Pixel Value')
-                        ax.set_ylabel('Frequency')
-                else:
-                    axes[1].hist(img_array.ravel(), bins=256, color='gray')
-                    axes[1].set_title('Grayscale Histogram')
-                    axes[0].axis('off')
-                    axes[2].axis('off')
-
-                plt.tight_layout()
-                output_path = filepath + '_graph.png'
-                plt.savefig(output_path, dpi=100, bbox_inches='tight')
-                plt.close()
-
-                subprocess.run(['notify-send', 'Graph Generated', f'Saved to: {os.path.basename(output_path)}'])
-
-            elif mime_type.startswith('audio/') or mime_type.startswith('video/'):
-                result = subprocess.run([
-                    'ffmpeg', '-i', filepath, '-ac', '1', '-ar', '8000',
-                    '-f', 's16le', '-'
-                ], capture_output=True, timeout=30)
-
-                if result.returncode == 0:
-                    audio_data = np.frombuffer(result.stdout, dtype=np.int16)
-                    step = max(1, len(audio_data) // 10000)
-                    audio_data = audio_data[::step]
-
-                    fig, ax = plt.subplots(figsize=(12, 4))
-                    time = np.arange(len(audio_data)) / 8000 * step
-                    ax.plot(time, audio_data, linewidth=0.5)
-                    ax.set_title('Audio Waveform')
-                    ax.set_xlabel('Time (seconds)')
-                    ax.set_ylabel('Amplitude')
-                    ax.grid(True, alpha=0.3)
-
-                    plt.tight_layout()
-                    output_path = filepath + '_waveform.png'
-                    plt.savefig(output_path, dpi=100, bbox_inches='tight')
-                    plt.close()
-
-                    subprocess.run(['notify-send', 'Graph Generated', f'Saved to: {os.path.basename(output_path)}'])
-            else:
-                subprocess.run(['notify-send', 'Graph Error', 'File type not supported for graphs'])
+            from fpeek_signal import graph_kind, graph_params, render_graph
+
+            stat = os.stat(filepath)
+            kind = graph_kind(get_file_metadata(filepath, stat).get('mime_type', ''))
 
+            if kind is None:
+                subprocess.run(['notify-send', 'Graph Error', 'File type not supported for graphs'])
+                return None
+
+            def render(path):
+                with span(f"graph {kind}", stat.st_size):
+                    render_graph(filepath, kind, path, task, GRAPH_EXACT)
+
+            cache = get_graph_cache()
+            params = graph_params(kind, GRAPH_EXACT)
+            with collect(f"graph {filepath}"):
+                output_path = cache.get(stat, kind, params)
+                if output_path is None:
+                    output_path = cache.put(stat, kind, params, render)
+            return output_path
+
+        except TaskCancelled:
+            pass
         except Exception as e:
             subprocess.run(['notify-send', 'Graph Error', str(e), '-u', 'critical'])
+        return None
 
-    def on_generate_archive(self, path):
+    def show_graph(self, filepath, graph_path):
+        dialog = Gtk.Window()
+        dialog.set_title(f"Graph: {os.path.basename(filepath)}")
+        dialog.set_default_size(1000, 700)
+
+        main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
+        main_box.set_margin_start(20)
+        main_box.set_margin_end(20)
+        main_box.set_margin_top(20)
+        main_box.set_margin_bottom(20)
+
+        picture = Gtk.Picture.new_for_filename(graph_path)
+        picture.set_vexpand(True)
+        main_box.append(picture)
+
+        close_btn = Gtk.Button(label="Close")
+        close_btn.set_halign(Gtk.Align.END)
+        close_btn.connect('clicked', lambda w: dialog.close())
+        main_box.append(close_btn)
+
+        dialog.set_child(main_box)
+        dialog.present()
+
+    def generate_archive(self, path, task):
         try:
             if os.path.isfile(path):
-                file_size = os.path.getsize(path)
-                max_file_size = 100 * 1024 * 1024 # 60 * 1024 * 1024
-
-                if file_size > max_file_size:
-                    subprocess.run([
-                        'notify-send',
-                        'Archive Error',
-                        f'File too large ({format_size(file_size)}). Maximum size: 100 MB - ! can adjust fpeek_analysis line 255',
-                        '-u', 'critical'
-                    ])
-                    return
-
-                metadata = get_file_metadata(path)
-                metadata['checksums'] = {
-                    'md5': calculate_hash(path, 'md5'),
-                    'sha256': calculate_hash(path, 'sha256'),
-                }
-                media_info = get_media_metadata(path)
-                if media_info:
-                    metadata['media'] = media_info
+                with collect(f"archive {path}") as timings:
+                    metadata = get_file_metadata(path)
+                    metadata['checksums'] = calculate_hashes(path, ('md5', 'sha256'), task=task)
+                    media_info = get_media_metadata(path, task, metadata['mime_type'])
+                    if media_info:
+                        metadata['media'] = media_info
+                if timings is not None:
+                    metadata['timings'] = timings.summary()
 
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
                 base_name = os.path.splitext(os.path.basename(path))[0]
                 archive_path = os.path.join(os.path.dirname(path), f"{base_name}_metadata_{timestamp}.json")
 
                 with open(archive_path, 'w') as f:
-                    json.dump(metadata, f, indent=2)
+                    json.dump(metadata.to_dict(), f, indent=2)
 
                 subprocess.run(['notify-send', 'Archive Created', f'Saved to: {os.path.basename(archive_path)}'])
 
             else:
-                total_files = 0
-                max_files = 1000
-
-                for root, dirs, files in os.walk(path):
-                    total_files += len(files)
-                    if total_files > max_files:
-                        subprocess.run([
-                            'notify-send',
-                            'Archive Error',
-                            f'Too many files (>{max_files}). Dir too large to archive - adjust in fpeek_analysis line 294.',
-                            '-u', 'critical'
-                        ])
-                        return
-
-                if total_files == 0:
-                    subprocess.run([
-                        'notify-send',
-                        'Archive Error',
-                        'No files found in directory',
-                        '-u', 'critical'
-                    ])
-                    return
-
-                metadata = {
-                    'directory': path,
-                    'generated': datetime.now().isoformat(),
-                    'files': []
-                }
-
-                for root, dirs, files in os.walk(path):
-                    for filename in files:
-                        filepath = os.path.join(root, filename)
-                        try:
-                            file_meta = get_file_metadata(filepath)
-                            file_meta['relative_path'] = os.path.relpath(filepath, path)
-                            file_meta['checksums'] = {
-                                'md5': calculate_hash(filepath, 'md5'),
-                                'sha256': calculate_hash(filepath, 'sha256'),
-                            }
-                            metadata['files'].append(file_meta)
-                        except:
-                            pass
-
-                metadata['summary'] = {
-                    'total_files': len(metadata['files']),
-                    'total_size_bytes': sum(f.get('size_bytes', 0) for f in metadata['files']),
-                }
-                metadata['summary']['total_size_human'] = format_size(
-                    metadata['summary']['total_size_bytes']
-                )
-
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
                 dir_name = os.path.basename(path.rstrip('/'))
-                archive_path = os.path.join(path, f"{dir_name}_archive_{timestamp}.json")
+                extension = ARCHIVE_EXTENSIONS[ARCHIVE_COMPRESSION]
 
-                with open(archive_path, 'w') as f:
-                    json.dump(metadata, f, indent=2)
+                baseline = None
+                if ARCHIVE_MODE in ('incremental', 'delta'):
+                    previous = find_previous_archive(path)
+                    baseline = open_baseline(previous) if previous else None
+                delta = baseline is not None and ARCHIVE_MODE == 'delta'
 
-                subprocess.run(['notify-send', 'Archive Created', f"{len(metadata['files'])} files archived"])
+                kind = 'delta' if delta else 'archive'
+                archive_path = os.path.join(path, f"{dir_name}_{kind}_{timestamp}{extension}")
 
+                try:
+                    self.stream_archive(archive_path, lambda: write_directory_archive(
+                        path, archive_path, ARCHIVE_JOBS, ARCHIVE_COMPRESSION, task,
+                        baseline=baseline, delta=delta
+                    ))
+                finally:
+                    if baseline is not None:
+                        baseline.close()
+
+        except TaskCancelled:
+            pass
         except Exception as e:
-            subprocess.run(['notify-send', 'Archive Error', str(e), '-u', 'critical'])
\ No newline at end of file
+            subprocess.run(['notify-send', 'Archive Error', str(e), '-u', 'critical'])
+
+    def generate_selection_archive(self, paths, task):
+        try:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            extension = ARCHIVE_EXTENSIONS[ARCHIVE_COMPRESSION]
+            archive_path = os.path.join(self.selection_archive_dir(paths),
+                                        f"selection_archive_{timestamp}{extension}")
+
+            self.stream_archive(archive_path, lambda: write_selection_archive(
+                paths, archive_path, ARCHIVE_JOBS, ARCHIVE_COMPRESSION, task
+            ))
+
+        except TaskCancelled:
+            pass
+        except Exception as e:
+            subprocess.run(['notify-send', 'Archive Error', str(e), '-u', 'critical'])
+
+    def stream_archive(self, archive_path, write):
+        """Run write() to produce archive_path and report the outcome.
+
+        A partial archive is removed if write() fails or is cancelled, and an
+        empty one is removed with an error notification.
+        """
+        try:
+            summary = write()
+        except BaseException:
+            if os.path.exists(archive_path):
+                os.remove(archive_path)
+            raise
+
+        if summary['total_files'] == 0:
+            os.remove(archive_path)
+            subprocess.run([
+                'notify-send',
+                'Archive Error',
+                'No files found',
+                '-u', 'critical'
+            ])
+            return
+
+        if 'added' in summary:
+            message = (f"{summary['added']} added, {summary['modified']} modified, "
+                       f"{summary['removed']} removed")
+        elif 'reused' in summary:
+            message = (f"{summary['total_files']} files archived, "
+                       f"{summary['total_files'] - summary['reused']} re-hashed")
+        else:
+            message = f"{summary['total_files']} files archived"
+        message += f"\nSaved to: {archive_path}"
+        subprocess.run(['notify-send', 'Archive Created', message])
\ No newline at end of file
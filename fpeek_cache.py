@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Persistent caches for fpeek: analysis results (MIME type, ffprobe output,
+digests) in SQLite, and rendered graphs as content-addressed PNG files.
+
+Entries are keyed by file identity (st_dev, st_ino) and are only valid while
+st_size and st_mtime_ns match, so a modified file is re-analysed on next use.
+The database is kept under MAX_BYTES (and MAX_ENTRIES rows) by dropping the
+least recently used entries.
+"""
+
+import os
+import json
+import hashlib
+import time
+import sqlite3
+import threading
+
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'fpeek'
+)
+MAX_ENTRIES = 500000
+MAX_BYTES = 256 * 1024 * 1024
+# ffprobe output larger than this (files with thousands of streams or
+# chapters) is only memoized for the session, never persisted
+MAX_MEDIA_JSON = 64 * 1024
+GRAPH_CACHE_MAX_BYTES = 256 * 1024 * 1024
+EVICT_CHECK_INTERVAL = 1000
+
+_UNSET = object()
+
+
+def file_key(stat):
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class MetadataCache:
+    def __init__(self, path=None, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, 'metadata.sqlite3')
+
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stores = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            ' dev INTEGER NOT NULL, ino INTEGER NOT NULL,'
+            ' size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,'
+            ' mime_type TEXT, media TEXT, digests TEXT,'
+            ' last_used REAL NOT NULL,'
+            ' PRIMARY KEY (dev, ino))'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)'
+        )
+
+    def _fetch(self, dev, ino, size, mtime_ns):
+        row = self._conn.execute(
+            'SELECT size, mtime_ns, mime_type, media, digests FROM entries'
+            ' WHERE dev = ? AND ino = ?', (dev, ino)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[0] != size or row[1] != mtime_ns:
+            self._conn.execute('DELETE FROM entries WHERE dev = ? AND ino = ?', (dev, ino))
+            return None
+        return row[2:]
+
+    def lookup(self, stat):
+        """Return cached fields for the file described by stat, or None.
+
+        The result is a dict that may contain 'mime_type', 'media' and
+        'digests'; missing keys were never stored for this file version.
+        """
+        dev, ino, size, mtime_ns = file_key(stat)
+        try:
+            with self._lock:
+                row = self._fetch(dev, ino, size, mtime_ns)
+                if row is None:
+                    return None
+                self._conn.execute(
+                    'UPDATE entries SET last_used = ? WHERE dev = ? AND ino = ?',
+                    (time.time(), dev, ino)
+                )
+        except sqlite3.Error:
+            return None
+
+        mime_type, media, digests = row
+        entry = {}
+        if mime_type is not None:
+            entry['mime_type'] = mime_type
+        if media is not None:
+            entry['media'] = json.loads(media)
+        if digests is not None:
+            entry['digests'] = json.loads(digests)
+        return entry
+
+    def store(self, stat, mime_type=None, media=_UNSET, digests=None):
+        """Merge the given fields into the entry for this file version.
+
+        media=None is stored as "probed, not a media file"; leave it unset
+        to keep whatever was cached before.
+        """
+        dev, ino, size, mtime_ns = file_key(stat)
+        if media is not _UNSET:
+            media = json.dumps(media)
+            if len(media) > MAX_MEDIA_JSON:
+                media = _UNSET
+        try:
+            with self._lock:
+                row = self._fetch(dev, ino, size, mtime_ns)
+                old_mime, old_media, old_digests = row if row else (None, None, None)
+
+                if digests and old_digests:
+                    digests = {**json.loads(old_digests), **digests}
+
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO entries'
+                    ' (dev, ino, size, mtime_ns, mime_type, media, digests, last_used)'
+                    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        dev, ino, size, mtime_ns,
+                        mime_type if mime_type is not None else old_mime,
+                        media if media is not _UNSET else old_media,
+                        json.dumps(digests) if digests else old_digests,
+                        time.time(),
+                    )
+                )
+
+                self._stores += 1
+                if self._stores % EVICT_CHECK_INTERVAL == 0:
+                    self._evict()
+        except sqlite3.Error:
+            pass
+
+    def _used_bytes(self):
+        """Bytes of database pages in use; pages freed by DELETE are not counted."""
+        page_size = self._conn.execute('PRAGMA page_size').fetchone()[0]
+        pages = self._conn.execute('PRAGMA page_count').fetchone()[0]
+        free = self._conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return (pages - free) * page_size
+
+    def _delete_oldest(self, n):
+        self._conn.execute(
+            'DELETE FROM entries WHERE rowid IN'
+            ' (SELECT rowid FROM entries ORDER BY last_used LIMIT ?)', (n,)
+        )
+
+    def _evict(self):
+        count = self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        # Trim to 90% so eviction does not run again on the very next check
+        if count > self.max_entries:
+            self._delete_oldest(count - int(self.max_entries * 0.9))
+            count = int(self.max_entries * 0.9)
+
+        used = self._used_bytes()
+        if used <= self.max_bytes:
+            return
+        while count and used > self.max_bytes * 0.9:
+            # Drop a slice proportional to the overshoot, then measure again
+            n = max(EVICT_CHECK_INTERVAL, int(count * (1 - self.max_bytes * 0.9 / used)))
+            self._delete_oldest(n)
+            count = max(0, count - n)
+            used = self._used_bytes()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM entries')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class GraphCache:
+    """Rendered graphs stored under a hash of (file identity, kind, params).
+
+    The directory is capped at max_bytes; the least recently used images
+    (by mtime, refreshed on every hit) are deleted first.
+    """
+
+    def __init__(self, directory=None, max_bytes=GRAPH_CACHE_MAX_BYTES):
+        self.directory = directory or os.path.join(CACHE_DIR, 'graphs')
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path_for(self, stat, kind, params):
+        key = json.dumps([file_key(stat), kind, params], sort_keys=True)
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.png")
+
+    def get(self, stat, kind, params):
+        path = self.path_for(stat, kind, params)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, stat, kind, params, render):
+        """Call render(path) to produce the graph and store it; returns its path."""
+        path = self.path_for(stat, kind, params)
+        # Render to a hidden temp name so readers never see a partial PNG
+        tmp_path = os.path.join(
+            self.directory, f".{os.getpid()}.{threading.get_ident()}.{os.path.basename(path)}"
+        )
+        try:
+            render(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._evict(keep=path)
+        return path
+
+    def _evict(self, keep=None):
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith('.') or not entry.name.endswith('.png'):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                total += st.st_size
+                if entry.path != keep:
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes * 0.9:
+                break
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_graph_cache = None
+
+
+def get_cache():
+    """Return the shared MetadataCache, or None if caching is unavailable.
+
+    Set FPEEK_NO_CACHE=1 to disable the cache entirely.
+    """
+    global _cache
+    if os.environ.get('FPEEK_NO_CACHE'):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = MetadataCache()
+                except (OSError, sqlite3.Error):
+                    _cache = False
+    return _cache or None
+
+
+def get_graph_cache():
+    global _graph_cache
+    if _graph_cache is None:
+        with _cache_lock:
+            if _graph_cache is None:
+                _graph_cache = GraphCache()
+    return _graph_cache
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+fpeek - headless command-line scanner
+
+Exposes metadata, hashing, archive and duplicate scans from fpeek_common
+without GTK or Nautilus. Results are written to stdout as NDJSON, one
+object per line, as soon as they are available.
+
+    fpeek meta [--media] PATH...
+    fpeek hash [-a md5,sha256] PATH...
+    fpeek archive [-o FILE] [--compression gzip|zstd|none] [--since ARCHIVE [--delta]] [--media] DIR
+    fpeek dups [--min-size BYTES] DIR...
+    fpeek similar [-d BITS] DIR...
+"""
+
+import os
+import sys
+import json
+import argparse
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+
+from fpeek_common import (
+    get_file_metadata, calculate_hashes, get_media_metadata, walk_tree, imap_bounded,
+    iter_directory_records, write_archive_stream, open_archive_stream, find_duplicates,
+    open_baseline, archive_compression,
+    DEFAULT_JOBS, ARCHIVE_ALGORITHMS, ARCHIVE_EXTENSIONS,
+)
+
+
+def _matches(relpath, patterns):
+    name = os.path.basename(relpath)
+    return any(fnmatch.fnmatch(relpath, p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+
+def iter_entries(dirpath, args):
+    """Yield DirEntry objects for files below dirpath that pass the globs."""
+    for entry, is_dir in walk_tree(dirpath, args.follow_symlinks, args.one_filesystem):
+        if is_dir:
+            continue
+        relpath = os.path.relpath(entry.path, dirpath)
+        if args.include and not _matches(relpath, args.include):
+            continue
+        if args.exclude and _matches(relpath, args.exclude):
+            continue
+        yield entry
+
+
+def iter_paths(paths, args):
+    """Expand directories in `paths` into their (filtered) files."""
+    for path in paths:
+        if os.path.isdir(path):
+            for entry in iter_entries(path, args):
+                yield entry.path
+        else:
+            yield path
+
+
+def emit(record):
+    sys.stdout.write(json.dumps(record) + '\n')
+
+
+def _meta_record(filepath, with_media):
+    try:
+        record = get_file_metadata(filepath)
+        if with_media:
+            media_info = get_media_metadata(filepath, mime_type=record['mime_type'])
+            if media_info:
+                record['media'] = media_info
+        return record.to_dict()
+    except OSError as e:
+        return {'filepath': filepath, 'error': str(e)}
+
+
+def cmd_meta(args):
+    with ThreadPoolExecutor(args.jobs) as pool:
+        records = imap_bounded(
+            pool, lambda path: _meta_record(path, args.media),
+            iter_paths(args.paths, args), args.jobs * 4
+        )
+        for record in records:
+            emit(record)
+    return 0
+
+
+def cmd_hash(args):
+    algorithms = tuple(a.strip() for a in args.algorithms.split(',') if a.strip())
+
+    def hash_record(filepath):
+        return {'filepath': filepath, **calculate_hashes(filepath, algorithms)}
+
+    with ThreadPoolExecutor(args.jobs) as pool:
+        for record in imap_bounded(pool, hash_record, iter_paths(args.paths, args), args.jobs * 4):
+            emit(record)
+    return 0
+
+
+def _has_archive_extension(path):
+    return any(path.endswith(extension) for extension in ARCHIVE_EXTENSIONS.values())
+
+
+def cmd_archive(args):
+    dirpath = args.directory
+    if not os.path.isdir(dirpath):
+        print(f"fpeek: not a directory: {dirpath}", file=sys.stderr)
+        return 1
+
+    exclude = (args.output,) if args.output and args.output != '-' else ()
+    if exclude:
+        # The extension decides, so --since can read the file back later
+        compression = archive_compression(args.output)
+        if args.compression is not None:
+            explicit = None if args.compression == 'none' else args.compression
+            if explicit != compression and _has_archive_extension(args.output):
+                print(f"fpeek: --compression {args.compression} does not match {args.output}",
+                      file=sys.stderr)
+                return 1
+            compression = explicit
+    elif args.compression not in (None, 'none'):
+        print("fpeek: --compression needs -o FILE; stdout is always uncompressed",
+              file=sys.stderr)
+        return 1
+
+    baseline = None
+    if args.since:
+        baseline = open_baseline(args.since)
+        if baseline is None:
+            print(f"fpeek: cannot read previous archive: {args.since}", file=sys.stderr)
+            return 1
+    elif args.delta:
+        print("fpeek: --delta needs --since", file=sys.stderr)
+        return 1
+
+    records = iter_directory_records(
+        dirpath, args.jobs, iter_entries(dirpath, args), exclude=exclude, baseline=baseline,
+        media=args.media
+    )
+
+    if exclude:
+        try:
+            out = open_archive_stream(args.output, compression)
+        except (ValueError, OSError) as e:
+            print(f"fpeek: {e}", file=sys.stderr)
+            return 1
+        with out:
+            summary = write_archive_stream(out, dirpath, records, baseline, args.delta)
+        print(json.dumps(summary), file=sys.stderr)
+    else:
+        write_archive_stream(sys.stdout, dirpath, records, baseline, args.delta)
+    return 0
+
+
+def cmd_dups(args):
+    for dirpath in args.directories:
+        duplicates = find_duplicates(
+            dirpath, args.jobs, min_size=args.min_size, entries=iter_entries(dirpath, args)
+        )
+        for group in duplicates:
+            emit(group)
+    return 0
+
+
+def cmd_similar(args):
+    # Imported here so the other commands work without numpy and Pillow
+    from fpeek_similar import find_similar_images
+
+    for dirpath in args.directories:
+        groups = find_similar_images(
+            dirpath, args.distance, args.jobs, entries=iter_entries(dirpath, args)
+        )
+        for group in groups:
+            emit(group)
+    return 0
+
+
+def build_parser():
+    # Shared options live on a parent parser so they can follow the subcommand
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS,
+                        help=f'worker threads (default: {DEFAULT_JOBS})')
+    common.add_argument('--include', action='append', default=[], metavar='GLOB',
+                        help='only scan files whose relative path or name matches (repeatable)')
+    common.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+                        help='skip files whose relative path or name matches (repeatable)')
+    common.add_argument('--follow-symlinks', action='store_true',
+                        help='descend into symlinked directories')
+    common.add_argument('--one-filesystem', action='store_true',
+                        help='do not cross mount points')
+
+    parser = argparse.ArgumentParser(
+        prog='fpeek',
+        description='Scan files and directories and print NDJSON results.'
+    )
+
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    meta = commands.add_parser('meta', parents=[common], help='file metadata')
+    meta.add_argument('--media', action='store_true', help='include ffprobe data for media files')
+    meta.add_argument('paths', nargs='+')
+    meta.set_defaults(func=cmd_meta)
+
+    hashes = commands.add_parser('hash', parents=[common], help='file checksums')
+    hashes.add_argument('-a', '--algorithms', default=','.join(ARCHIVE_ALGORITHMS),
+                        help='comma-separated hashlib names (default: %(default)s)')
+    hashes.add_argument('paths', nargs='+')
+    hashes.set_defaults(func=cmd_hash)
+
+    archive = commands.add_parser('archive', parents=[common],
+                                  help='metadata + checksum archive of a directory')
+    archive.add_argument('-o', '--output', default='-',
+                         help='archive file (default: stdout, uncompressed)')
+    archive.add_argument('--compression', choices=('gzip', 'zstd', 'none'),
+                         help='compression when writing to a file (default: from its '
+                              'extension, .jsonl.gz, .jsonl.zst or .jsonl)')
+    archive.add_argument('--since', metavar='ARCHIVE',
+                         help='previous archive; unchanged files reuse its records')
+    archive.add_argument('--delta', action='store_true',
+                         help='with --since, write only added, modified and removed files')
+    archive.add_argument('--media', action='store_true',
+                         help='include ffprobe data for media files (one process per file)')
+    archive.add_argument('directory')
+    archive.set_defaults(func=cmd_archive)
+
+    dups = commands.add_parser('dups', parents=[common],
+                               help='groups of files with identical content')
+    dups.add_argument('--min-size', type=int, default=1, metavar='BYTES',
+                      help='ignore files smaller than this (default: %(default)s)')
+    dups.add_argument('directories', nargs='+')
+    dups.set_defaults(func=cmd_dups)
+
+    similar = commands.add_parser('similar', parents=[common],
+                                  help='groups of visually similar images')
+    similar.add_argument('-d', '--distance', type=int, default=8, metavar='BITS',
+                         help='max perceptual hash difference, 0-64 (default: %(default)s)')
+    similar.add_argument('directories', nargs='+')
+    similar.set_defaults(func=cmd_similar)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.jobs = max(1, args.jobs)
+    try:
+        return args.func(args)
+    except BrokenPipeError:
+        # Output was piped into something like `head`; stop quietly
+        sys.stderr.close()
+        return 0
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
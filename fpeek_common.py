@@ -1,59 +1,401 @@
 #!/usr/bin/env python3
 import os
+import stat as stat_module
+import gzip
+import mmap
+import queue
 import json
 import hashlib
 import subprocess
+import threading
+import time
+from collections import deque, OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, Future
 from datetime import datetime
+from fpeek_cache import get_cache, file_key
+from fpeek_mime import detect_mime_type
+from fpeek_trace import span, collect
 
 
-def calculate_hash(filepath, algorithm='sha256'):
+HASH_BUFFER_SIZE = 1024 * 1024
+# Files at least this large are hashed with read-ahead and without
+# leaving their pages in the page cache; see _read_ahead_chunks()
+LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+LARGE_HASH_BUFFER = 4 * 1024 * 1024
+READ_AHEAD_BUFFERS = 3
+DROP_BEHIND_BYTES = 32 * 1024 * 1024
+# mmap is opt-in: a file truncated while mapped kills the process (SIGBUS)
+HASH_USE_MMAP = os.environ.get('FPEEK_HASH_MMAP', '0') not in ('', '0')
+DEFAULT_JOBS = min(8, os.cpu_count() or 1)
+ARCHIVE_ALGORITHMS = ('md5', 'sha256')
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class Task:
+    """Cancellation flag and progress counters shared with a worker thread.
+
+    Long-running helpers in this module accept an optional task and call
+    task.check() between units of work, so cancel() stops them promptly.
+    """
+
+    def __init__(self):
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        self.files_scanned = 0
+        self.bytes_hashed = 0
+        self.done = False
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check(self):
+        if self._cancel_event.is_set():
+            raise TaskCancelled()
+
+    def add_progress(self, files=0, nbytes=0):
+        with self._lock:
+            self.files_scanned += files
+            self.bytes_hashed += nbytes
+
+
+def run_in_background(work, on_done, dispatch, task=None):
+    """Run work(task) in a daemon thread and report back through dispatch.
+
+    on_done(result, error) is handed to dispatch (GLib.idle_add in the
+    Nautilus extensions) so it runs on the caller's main loop; error is
+    the raised exception or None.
+    """
+    task = task or Task()
+
+    def deliver(result, error):
+        task.done = True
+        on_done(result, error)
+        return False
+
+    def runner():
+        try:
+            result = work(task)
+        except BaseException as e:
+            dispatch(deliver, None, e)
+        else:
+            dispatch(deliver, result, None)
+
+    threading.Thread(target=runner, daemon=True).start()
+    return task
+
+
+def run_command(args, timeout=None, task=None, text=False):
+    """subprocess.run(capture_output=True) that kills the child on cancel."""
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=text)
+    deadline = time.monotonic() + timeout if timeout else None
+    while True:
+        try:
+            stdout, stderr = proc.communicate(timeout=0.2)
+            return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
+        except subprocess.TimeoutExpired:
+            cancelled = task is not None and task.cancelled
+            if cancelled or (deadline and time.monotonic() > deadline):
+                proc.kill()
+                proc.communicate()
+                if cancelled:
+                    raise TaskCancelled()
+                raise subprocess.TimeoutExpired(args, timeout)
+
+
+def _fadvise(fd, offset, length, advice_name):
+    advice = getattr(os, advice_name, None)
+    if advice is None:
+        return
     try:
-        hash_obj = hashlib.new(algorithm)
-        with open(filepath, 'rb') as f:
-            for chunk in iter(lambda: f.read(8192), b''):
-                hash_obj.update(chunk)
-        return hash_obj.hexdigest()
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
+
+
+class _DropBehind:
+    """Evict already-hashed pages of a large file from the page cache."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.done = 0
+        self.dropped = 0
+        _fadvise(fd, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+
+    def advance(self, n, final=False):
+        self.done += n
+        if final or self.done - self.dropped >= DROP_BEHIND_BYTES:
+            _fadvise(self.fd, self.dropped, self.done - self.dropped, 'POSIX_FADV_DONTNEED')
+            self.dropped = self.done
+
+
+def _read_chunks(f, buffer_size):
+    """Yield views of one preallocated buffer, refilled with readinto()."""
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    while True:
+        n = f.readinto(buf)
+        if not n:
+            return
+        yield view[:n] if n < buffer_size else view
+
+
+def _read_ahead_chunks(f, buffer_size=LARGE_HASH_BUFFER, depth=READ_AHEAD_BUFFERS):
+    """Yield chunks read by a background thread while the caller digests.
+
+    `depth` preallocated buffers circulate between the reader and the
+    caller, so the disk stays busy while hashing (readinto() and hashlib
+    both release the GIL). Hashed ranges are dropped from the page cache.
+    """
+    free = queue.Queue()
+    filled = queue.Queue()
+    stop = threading.Event()
+    for _ in range(depth):
+        free.put(bytearray(buffer_size))
+
+    def reader():
+        try:
+            while True:
+                buf = free.get()
+                if buf is None or stop.is_set():
+                    return
+                n = f.readinto(buf)
+                filled.put((buf, n))
+                if not n:
+                    return
+        except BaseException as e:
+            filled.put((None, e))
+
+    drop = _DropBehind(f.fileno())
+    thread = threading.Thread(target=reader, name='fpeek-read-ahead', daemon=True)
+    thread.start()
+    try:
+        while True:
+            buf, n = filled.get()
+            if buf is None:
+                raise n
+            if not n:
+                drop.advance(0, final=True)
+                return
+            with memoryview(buf) as view, view[:n] as chunk:
+                yield chunk
+            free.put(buf)
+            drop.advance(n)
+    finally:
+        # Unblock the reader if it is waiting for a buffer, then wait for it
+        stop.set()
+        free.put(None)
+        thread.join()
+
+
+def _mmap_chunks(f, size, chunk_size=LARGE_HASH_BUFFER):
+    """Yield consecutive slices of a read-only mapping of the file."""
+    drop = _DropBehind(f.fileno())
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if hasattr(mapped, 'madvise'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        with memoryview(mapped) as view:
+            for offset in range(0, size, chunk_size):
+                with view[offset:offset + chunk_size] as chunk:
+                    yield chunk
+                    n = len(chunk)
+                drop.advance(n, final=offset + n >= size)
+
+
+def calculate_hashes(filepath, algorithms=('md5', 'sha256'), buffer_size=HASH_BUFFER_SIZE, task=None):
+    """Compute several digests of a file in a single read pass.
+
+    Returns a dict mapping each algorithm name to its hex digest. Small
+    files are read into one preallocated buffer with readinto(), so no
+    bytes objects are allocated per chunk. Files of LARGE_FILE_THRESHOLD
+    and more are read ahead in a background thread (or mapped, with
+    FPEEK_HASH_MMAP=1) and kept out of the page cache, so checksumming a
+    multi-GB file does not evict everything else. Anything but a regular
+    file (FIFO, device, socket) is reported as an error without reading.
+    """
+    try:
+        hash_objs = [(name, hashlib.new(name)) for name in algorithms]
+        # O_NONBLOCK so opening a FIFO with no writer returns immediately
+        fd = os.open(filepath, os.O_RDONLY | os.O_NONBLOCK)
+        with open(fd, 'rb', buffering=0) as f:
+            stat = os.fstat(fd)
+            if not stat_module.S_ISREG(stat.st_mode):
+                return {name: "Error: not a regular file" for name in algorithms}
+            cache = get_cache()
+            if cache:
+                cached = (cache.lookup(stat) or {}).get('digests', {})
+                if all(name in cached for name in algorithms):
+                    return {name: cached[name] for name in algorithms}
+
+            if stat.st_size < LARGE_FILE_THRESHOLD:
+                chunks = _read_chunks(f, buffer_size)
+            elif HASH_USE_MMAP:
+                chunks = _mmap_chunks(f, stat.st_size)
+            else:
+                chunks = _read_ahead_chunks(f)
+
+            with span('hash') as timing:
+                try:
+                    for chunk in chunks:
+                        for _, hash_obj in hash_objs:
+                            hash_obj.update(chunk)
+                        n = len(chunk)
+                        timing.add_bytes(n)
+                        if task:
+                            task.check()
+                            task.add_progress(nbytes=n)
+                finally:
+                    # Stops the read-ahead thread / unmaps before the file closes
+                    chunks.close()
+
+        digests = {name: hash_obj.hexdigest() for name, hash_obj in hash_objs}
+        if cache:
+            cache.store(stat, digests=digests)
+        return digests
     except (OSError, PermissionError) as e:
-        return f"Error: {str(e)}"
+        return {name: f"Error: {str(e)}" for name in algorithms}
+    except TaskCancelled:
+        raise
     except Exception:
-        return None
+        return {name: None for name in algorithms}
+
+
+def calculate_hash(filepath, algorithm='sha256'):
+    return calculate_hashes(filepath, (algorithm,))[algorithm]
+
+
+MEDIA_MIME_PREFIXES = ('audio/', 'video/', 'image/')
+MEDIA_MIME_TYPES = {
+    'application/ogg', 'application/mxf', 'application/x-matroska',
+    'application/vnd.rn-realmedia', 'application/x-shockwave-flash',
+}
+MAX_CONCURRENT_PROBES = max(2, DEFAULT_JOBS // 2)
+MEDIA_MEMO_SIZE = 4096
+
+_probe_slots = threading.BoundedSemaphore(MAX_CONCURRENT_PROBES)
+_media_memo = OrderedDict()
+_media_memo_lock = threading.Lock()
+
+
+def is_media_mime_type(mime_type):
+    return bool(mime_type) and (
+        mime_type.startswith(MEDIA_MIME_PREFIXES) or mime_type in MEDIA_MIME_TYPES
+    )
+
+
+def has_duration(mime_type):
+    """Whether a media type has a running time (still images do not)."""
+    return is_media_mime_type(mime_type) and not mime_type.startswith('image/')
+
 
+def _memo_get(key):
+    with _media_memo_lock:
+        if key in _media_memo:
+            _media_memo.move_to_end(key)
+            return True, _media_memo[key]
+    return False, None
 
-def get_media_metadata(filepath):
-    if not os.path.isfile(filepath):
+
+def _memo_put(key, media):
+    with _media_memo_lock:
+        _media_memo[key] = media
+        _media_memo.move_to_end(key)
+        while len(_media_memo) > MEDIA_MEMO_SIZE:
+            _media_memo.popitem(last=False)
+
+
+def get_media_metadata(filepath, task=None, mime_type=None, stat=None):
+    """Return ffprobe's JSON for a media file, or None.
+
+    Files whose MIME type is not audio/video/image are never probed. Results
+    are memoized for the session per file identity and persisted in the
+    metadata cache; at most MAX_CONCURRENT_PROBES ffprobe processes run at
+    once across all threads.
+    """
+    try:
+        stat = stat or os.stat(filepath)
+    except OSError:
+        return None
+    if not stat_module.S_ISREG(stat.st_mode):
+        return None
+
+    if not is_media_mime_type(mime_type or get_mime_type(filepath, stat)):
         return None
 
+    key = file_key(stat)
+    found, media = _memo_get(key)
+    if found:
+        return media
+
+    cache = get_cache()
+    if cache:
+        cached = cache.lookup(stat)
+        if cached and 'media' in cached:
+            _memo_put(key, cached['media'])
+            return cached['media']
+
+    media = None
     try:
-        result = subprocess.run(
-            ['ffprobe', '-v', 'quiet', '-print_format', 'json',
-             '-show_format', '-show_streams', filepath],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
+        with _probe_slots:
+            if task:
+                task.check()
+            with span('ffprobe'):
+                result = run_command(
+                    ['ffprobe', '-v', 'quiet', '-print_format', 'json',
+                     '-show_format', '-show_streams', filepath],
+                    timeout=10,
+                    task=task,
+                    text=True
+                )
         if result.returncode == 0:
-            return json.loads(result.stdout)
+            media = json.loads(result.stdout)
     except (subprocess.TimeoutExpired, FileNotFoundError, json.JSONDecodeError):
-        pass
+        return None
+    except TaskCancelled:
+        raise
     except Exception:
-        pass
-    return None
+        return None
+
+    _memo_put(key, media)
+    if cache:
+        cache.store(stat, media=media)
+    return media
+
 
+def probe_media_batch(filepaths, max_procs=MAX_CONCURRENT_PROBES, task=None):
+    """get_media_metadata() for many files, in input order."""
+    with ThreadPoolExecutor(max(1, max_procs)) as pool:
+        return list(pool.map(lambda filepath: get_media_metadata(filepath, task), filepaths))
 
-def get_mime_type(filepath):
+
+def get_mime_type(filepath, stat=None):
     """Get MIME type"""
-    if os.path.isdir(filepath):
+    if stat_module.S_ISDIR(stat.st_mode) if stat else os.path.isdir(filepath):
         return 'inode/directory'
 
-    try:
-        result = subprocess.run(
-            ['file', '--mime-type', '-b', filepath],
-            capture_output=True,
-            text=True
-        )
-        return result.stdout.strip()
-    except Exception:
-        return 'unknown'
+    cache = get_cache()
+    if cache:
+        try:
+            stat = stat or os.stat(filepath)
+        except OSError:
+            return 'unknown'
+        cached = cache.lookup(stat)
+        if cached and 'mime_type' in cached:
+            return cached['mime_type']
+
+    with span('mime'):
+        mime_type = detect_mime_type(filepath, stat)
+
+    if cache and mime_type != 'unknown':
+        cache.store(stat, mime_type=mime_type)
+    return mime_type
 
 
 def format_size(size):
@@ -67,29 +409,764 @@ def format_size(size):
     return f"{size:.2f} PB"
 
 
-def get_file_metadata(filepath):
-    if not os.path.exists(filepath):
-        raise FileNotFoundError(f"Path does not exist: {filepath}")
+class FileRecord(Mapping):
+    """Metadata of one file, kept as raw stat fields.
+
+    Dates, the human-readable size, permissions and the extension are only
+    formatted when read (while rendering or serializing), so large scans do
+    not allocate them per file. Behaves as a mapping with the keys of the
+    classic metadata dict; other keys such as 'checksums' or 'media' can be
+    assigned with record[key] = value. Use to_dict() for JSON.
+    """
+
+    __slots__ = ('filepath', 'mode', 'size_bytes', 'ctime', 'mtime', 'atime', 'mtime_ns',
+                 'inode', 'owner_uid', 'group_gid', 'mime_type', '_extra')
+
+    KEYS = ('filename', 'filepath', 'is_directory', 'size_bytes', 'size_human', 'created',
+            'modified', 'accessed', 'permissions', 'owner_uid', 'group_gid', 'mime_type',
+            'extension', 'mtime_ns', 'inode')
+
+    def __init__(self, filepath, stat, mime_type):
+        self.filepath = filepath
+        self.mode = stat.st_mode
+        self.size_bytes = stat.st_size
+        self.ctime = stat.st_ctime
+        self.mtime = stat.st_mtime
+        self.atime = stat.st_atime
+        self.mtime_ns = stat.st_mtime_ns
+        self.inode = stat.st_ino
+        self.owner_uid = stat.st_uid
+        self.group_gid = stat.st_gid
+        self.mime_type = mime_type
+        self._extra = None
+
+    @property
+    def filename(self):
+        return os.path.basename(self.filepath)
+
+    @property
+    def is_directory(self):
+        return stat_module.S_ISDIR(self.mode)
+
+    @property
+    def size_human(self):
+        return format_size(self.size_bytes)
+
+    @property
+    def created(self):
+        return datetime.fromtimestamp(self.ctime).isoformat()
+
+    @property
+    def modified(self):
+        return datetime.fromtimestamp(self.mtime).isoformat()
+
+    @property
+    def accessed(self):
+        return datetime.fromtimestamp(self.atime).isoformat()
+
+    @property
+    def permissions(self):
+        return oct(self.mode)[-3:]
+
+    @property
+    def extension(self):
+        return os.path.splitext(self.filepath)[1] if stat_module.S_ISREG(self.mode) else ''
+
+    def __getitem__(self, key):
+        if key in self.KEYS:
+            return getattr(self, key)
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.KEYS:
+            raise KeyError(f"{key} is derived from the file's stat and cannot be set")
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def __iter__(self):
+        yield from self.KEYS
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return len(self.KEYS) + (len(self._extra) if self._extra is not None else 0)
+
+    def to_dict(self):
+        return {key: self[key] for key in self}
+
+
+def get_file_metadata(filepath, stat=None):
+    """Return a FileRecord for filepath (a read-mostly mapping, see FileRecord)."""
+    if stat is None:
+        if not os.path.exists(filepath):
+            raise FileNotFoundError(f"Path does not exist: {filepath}")
+
+        try:
+            with span('stat'):
+                stat = os.stat(filepath)
+        except PermissionError:
+            raise PermissionError(f"Permission denied: {filepath}")
+
+    return FileRecord(filepath, stat, get_mime_type(filepath, stat))
+
+
+def walk_tree(root, follow_symlinks=False, one_filesystem=False, limit=None, task=None):
+    """Yield (DirEntry, is_dir) for everything below root in one pass.
+
+    Built on os.scandir so callers can use entry.stat() without an extra
+    syscall per path where the OS provides it. Directories are visited in
+    name order, files before subdirectories. Symlinked directories are only
+    descended into with follow_symlinks; with one_filesystem, mount points
+    are reported but not descended into. Iteration stops once
+    `limit` non-directory entries have been yielded.
+    """
+    try:
+        root_stat = os.stat(root)
+    except OSError:
+        return
+
+    seen = {(root_stat.st_dev, root_stat.st_ino)}
+    stack = [root]
+    file_count = 0
+
+    while stack:
+        if task:
+            task.check()
+        try:
+            with span('scandir'), os.scandir(stack.pop()) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                # Like os.walk: symlinked directories are reported as
+                # directories but only descended into with follow_symlinks
+                descend = follow_symlinks or not entry.is_symlink()
+                if descend and (one_filesystem or follow_symlinks):
+                    try:
+                        st = entry.stat()
+                        if one_filesystem and st.st_dev != root_stat.st_dev:
+                            descend = False
+                        elif follow_symlinks:
+                            # Symlinked directories can form cycles
+                            key = (st.st_dev, st.st_ino)
+                            descend = key not in seen
+                            seen.add(key)
+                    except OSError:
+                        descend = False
+                if descend:
+                    subdirs.append(entry.path)
+            else:
+                file_count += 1
+                if task:
+                    task.add_progress(files=1)
+
+            yield entry, is_dir
+
+            if limit is not None and file_count >= limit:
+                return
 
+        stack.extend(reversed(subdirs))
+
+
+def directory_totals(dirpath, follow_symlinks=False, one_filesystem=False, task=None):
+    """Return (files, subdirectories, total size in bytes) below dirpath."""
+    total_files = 0
+    total_dirs = 0
+    total_size = 0
+
+    for entry, is_dir in walk_tree(dirpath, follow_symlinks, one_filesystem, task=task):
+        if is_dir:
+            total_dirs += 1
+            continue
+        total_files += 1
+        try:
+            total_size += entry.stat().st_size
+        except OSError:
+            pass
+
+    return total_files, total_dirs, total_size
+
+
+def imap_bounded(pool, func, iterable, window):
+    """Like pool.map(func, iterable), but with at most `window` calls in
+    flight, so arbitrarily long inputs are consumed lazily."""
+    pending = deque()
+    try:
+        for item in iterable:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _archive_file_metadata(entry, media=False, task=None):
+    if task:
+        task.check()
+    try:
+        with span('stat'):
+            stat = entry.stat()
+        file_meta = get_file_metadata(entry.path, stat)
+        if media:
+            media_info = get_media_metadata(entry.path, task, file_meta['mime_type'], stat)
+            if media_info:
+                file_meta['media'] = media_info
+        return file_meta
+    except TaskCancelled:
+        raise
+    except Exception:
+        return None
+
+
+def _archive_file_hashes(entry, task=None):
+    if task:
+        task.check()
     try:
-        stat = os.stat(filepath)
-    except PermissionError:
-        raise PermissionError(f"Permission denied: {filepath}")
-
-    metadata = {
-        'filename': os.path.basename(filepath),
-        'filepath': filepath,
-        'is_directory': os.path.isdir(filepath),
-        'size_bytes': stat.st_size,
-        'size_human': format_size(stat.st_size),
-        'created': datetime.fromtimestamp(stat.st_ctime).isoformat(),
-        'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
-        'accessed': datetime.fromtimestamp(stat.st_atime).isoformat(),
-        'permissions': oct(stat.st_mode)[-3:],
-        'owner_uid': stat.st_uid,
-        'group_gid': stat.st_gid,
-        'mime_type': get_mime_type(filepath),
-        'extension': os.path.splitext(filepath)[1] if os.path.isfile(filepath) else '',
+        # FIFOs would block open() forever, devices may never end
+        if not stat_module.S_ISREG(entry.stat().st_mode):
+            return None
+    except OSError:
+        return None
+    return calculate_hashes(entry.path, ARCHIVE_ALGORITHMS, task=task)
+
+
+def _resolved(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def iter_directory_records(dirpath, jobs=DEFAULT_JOBS, entries=None, task=None, exclude=(),
+                           baseline=None, media=False):
+    """Yield one archive record per file below dirpath, in walk order.
+
+    Stat/MIME detection and hashing run in two separate thread pools of
+    `jobs` workers each (hashlib releases the GIL while digesting). Only a
+    small window of files is in flight at once, so memory stays flat no
+    matter how large the tree is. Paths in `exclude` are skipped, as are
+    fpeek's own `<dir>_archive_*` / `<dir>_delta_*` files in dirpath.
+
+    With a `baseline` (an ArchiveBaseline), files unchanged since that
+    archive reuse its checksums instead of being hashed again. ffprobe
+    output is only added with `media`, since it costs one process per
+    audio/video/image file.
+    """
+    if entries is None:
+        entries = (entry for entry, is_dir in walk_tree(dirpath, task=task) if not is_dir)
+    exclude = {os.path.abspath(p) for p in exclude}
+    root = os.path.abspath(dirpath)
+
+    jobs = max(1, jobs)
+    window = jobs * 4
+    pending = deque()
+
+    def finish(entry, meta_future, hash_future):
+        file_meta = meta_future.result()
+        checksums = hash_future.result()
+        if file_meta is None:
+            return None
+        file_meta['relative_path'] = os.path.relpath(entry.path, dirpath)
+        file_meta['checksums'] = checksums
+        return file_meta
+
+    with ThreadPoolExecutor(jobs) as meta_pool, ThreadPoolExecutor(jobs) as hash_pool:
+        try:
+            for entry in entries:
+                path = os.path.abspath(entry.path)
+                if path in exclude:
+                    continue
+                if os.path.dirname(path) == root and is_directory_archive(root, entry.name):
+                    continue
+                previous = None
+                if baseline is not None:
+                    previous = baseline.reuse(entry, os.path.relpath(entry.path, dirpath))
+                if previous is not None:
+                    record, checksums = previous
+                    pending.append((entry, _resolved(record), _resolved(checksums)))
+                else:
+                    pending.append((
+                        entry,
+                        meta_pool.submit(_archive_file_metadata, entry, media, task),
+                        hash_pool.submit(_archive_file_hashes, entry, task),
+                    ))
+                if len(pending) >= window:
+                    record = finish(*pending.popleft())
+                    if record is not None:
+                        yield record
+
+            while pending:
+                record = finish(*pending.popleft())
+                if record is not None:
+                    yield record
+        finally:
+            for _, meta_future, hash_future in pending:
+                meta_future.cancel()
+                hash_future.cancel()
+
+
+def _archive_summary(total_files, total_size, timings=None):
+    summary = {
+        'total_files': total_files,
+        'total_size_bytes': total_size,
+        'total_size_human': format_size(total_size),
     }
+    if timings is not None:
+        summary['timings'] = timings.summary()
+    return summary
+
+
+PARTIAL_HASH_BLOCK = 64 * 1024
+
+
+def partial_hash(filepath, block_size=PARTIAL_HASH_BLOCK, algorithm='sha256'):
+    """Hash the file size plus its first and last block_size bytes."""
+    try:
+        with span('partial_hash'), open(filepath, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            hash_obj = hashlib.new(algorithm, str(size).encode())
+            hash_obj.update(f.read(block_size))
+            if size > block_size:
+                f.seek(max(block_size, size - block_size))
+                hash_obj.update(f.read(block_size))
+        return hash_obj.hexdigest()
+    except OSError:
+        return None
+
+
+def _group_parallel(candidates, key_func, jobs, task=None):
+    """Regroup (size, paths) candidates by (size, key_func(path)).
+
+    Returns {(size, key): paths} for groups of 2+. At most a few calls per
+    worker are in flight, so the candidate list is never expanded into one
+    future per file.
+    """
+    def keyed(item):
+        if task:
+            task.check()
+        size, path = item
+        return size, path, key_func(path)
+
+    items = ((size, path) for size, group in candidates for path in group)
+    groups = {}
+    with ThreadPoolExecutor(max(1, jobs)) as pool:
+        for size, path, key in imap_bounded(pool, keyed, items, max(1, jobs) * 4):
+            if key is not None and not str(key).startswith('Error'):
+                groups.setdefault((size, key), []).append(path)
+    return {key: group for key, group in groups.items() if len(group) > 1}
+
+
+def find_duplicates(dirpath, jobs=DEFAULT_JOBS, min_size=1, algorithm='sha256', task=None,
+                    entries=None):
+    """Find groups of files with identical content below dirpath.
+
+    Files are grouped by size first, then by a hash of their head and tail
+    blocks, and only the survivors are fully hashed (in parallel, through
+    calculate_hashes, so cached digests are reused). Hard links to the same inode count as one file.
+    Returns dicts with 'size', 'digest' and sorted 'paths', largest wasted
+    space first. Pass `entries` to search a pre-filtered list of files.
+    """
+    with collect(f"duplicates {dirpath}"):
+        return _find_duplicates(dirpath, jobs, min_size, algorithm, task, entries)
+
+
+def _find_duplicates(dirpath, jobs, min_size, algorithm, task, entries):
+    if entries is None:
+        entries = (entry for entry, is_dir in walk_tree(dirpath, task=task) if not is_dir)
+
+    by_size = {}
+    seen_inodes = set()
+    for entry in entries:
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        if not stat_module.S_ISREG(st.st_mode) or st.st_size < min_size:
+            continue
+        if (st.st_dev, st.st_ino) in seen_inodes:
+            continue
+        seen_inodes.add((st.st_dev, st.st_ino))
+        by_size.setdefault(st.st_size, []).append(entry.path)
+    seen_inodes.clear()
+
+    candidates = [(size, group) for size, group in by_size.items() if len(group) > 1]
+    by_size.clear()
+
+    candidates = [
+        (size, group) for (size, _), group in _group_parallel(
+            candidates,
+            lambda path: partial_hash(path, algorithm=algorithm),
+            jobs, task
+        ).items()
+    ]
+    full_groups = _group_parallel(
+        candidates,
+        lambda path: calculate_hashes(path, (algorithm,), task=task)[algorithm],
+        jobs, task
+    )
+
+    duplicates = [
+        {'size': size, 'digest': digest, 'paths': sorted(group)}
+        for (size, digest), group in full_groups.items()
+    ]
+    duplicates.sort(key=lambda d: d['size'] * (len(d['paths']) - 1), reverse=True)
+    return duplicates
+
+
+ARCHIVE_EXTENSIONS = {None: '.jsonl', 'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+
+
+def open_archive_stream(path, compression=None, mode='wt'):
+    """Open a JSON Lines archive, optionally gzip or zstd compressed.
+
+    zstd needs the optional `zstandard` package.
+    """
+    if compression is None:
+        return open(path, mode, encoding='utf-8')
+    if compression == 'gzip':
+        return gzip.open(path, mode, encoding='utf-8', compresslevel=6)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd compression requires the 'zstandard' package")
+        return zstandard.open(path, mode, encoding='utf-8')
+    raise ValueError(f"Unknown archive compression: {compression}")
+
+
+def archive_compression(path):
+    """Guess the compression of an archive from its file name."""
+    for compression, extension in ARCHIVE_EXTENSIONS.items():
+        if compression and path.endswith(extension):
+            return compression
+    return None
+
+
+def is_directory_archive(dirpath, name, kinds=('archive', 'delta')):
+    """Whether `name` (in dirpath itself) is one of fpeek's own
+    `<dir>_<kind>_<timestamp>.jsonl*` archives of dirpath."""
+    base = os.path.basename(os.path.abspath(dirpath))
+    return (any(name.startswith(f"{base}_{kind}_") for kind in kinds)
+            and any(name.endswith(ext) for ext in ARCHIVE_EXTENSIONS.values()))
+
+
+def find_previous_archive(dirpath):
+    """Return the newest full `<dir>_archive_<timestamp>.jsonl*` in dirpath, or None."""
+    try:
+        names = [
+            name for name in os.listdir(dirpath)
+            if is_directory_archive(dirpath, name, ('archive',))
+        ]
+    except OSError:
+        return None
+    # Timestamps are zero-padded, so name order is chronological
+    return os.path.join(dirpath, max(names)) if names else None
+
+
+class ArchiveBaseline:
+    """Checksums from a previous archive, for incremental re-archiving.
+
+    A file is unchanged if its relative path, size, mtime_ns and inode all
+    match its previous record. Only those fields, the checksums, the MIME
+    type and the ffprobe output are kept per file; everything else is read
+    from the current stat, so permission, owner or location changes show up
+    in the new archive.
+
+    Files that failed to hash are always retried. Files that were never
+    hashed (FIFOs, sockets, devices) are reused while they match and are
+    still not regular files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # relative path -> (size, mtime_ns, inode, checksums, mime_type, media JSON);
+        # checksums is () for files that were not hashed, None to retry them
+        self._records = {}
+        # relative path -> whether the previous record was reused
+        self._seen = {}
+        self.reused = 0
+
+        with open_archive_stream(path, archive_compression(path), 'rt') as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get('type') != 'file' or 'mtime_ns' not in record:
+                    continue
+                checksums = record.get('checksums')
+                if checksums is None:
+                    checksums = ()
+                elif all(isinstance(checksums.get(name), str)
+                       and not checksums[name].startswith('Error')
+                       for name in ARCHIVE_ALGORITHMS):
+                    checksums = tuple(checksums[name] for name in ARCHIVE_ALGORITHMS)
+                else:
+                    # Still listed, so it counts as modified rather than added
+                    checksums = None
+                media = record.get('media')
+                self._records[record['relative_path']] = (
+                    record.get('size_bytes'), record['mtime_ns'], record.get('inode'), checksums,
+                    record.get('mime_type'), json.dumps(media) if media is not None else None
+                )
+
+    def __len__(self):
+        return len(self._records)
+
+    def reuse(self, entry, relative_path):
+        """Return (FileRecord, checksums) for an unchanged file, or None.
+
+        The record is built from the file's current stat; only the
+        checksums, MIME type and media info come from the baseline.
+        """
+        self._seen[relative_path] = False
+        previous = self._records.get(relative_path)
+        if previous is None or previous[3] is None:
+            return None
+        try:
+            with span('stat'):
+                st = entry.stat()
+        except OSError:
+            return None
+        if previous[:3] != (st.st_size, st.st_mtime_ns, st.st_ino):
+            return None
+
+        _, _, _, checksums, mime_type, media = previous
+        if not checksums and stat_module.S_ISREG(st.st_mode):
+            return None
+        record = FileRecord(entry.path, st, mime_type or get_mime_type(entry.path, st))
+        if media is not None:
+            record['media'] = json.loads(media)
+        self._seen[relative_path] = True
+        self.reused += 1
+        return record, dict(zip(ARCHIVE_ALGORITHMS, checksums)) if checksums else None
+
+    def was_reused(self, relative_path):
+        return self._seen.get(relative_path, False)
+
+    def is_new(self, relative_path):
+        return relative_path not in self._records
+
+    def removed(self):
+        """Relative paths in the baseline that the current walk did not see."""
+        return sorted(path for path in self._records if path not in self._seen)
+
+    def close(self):
+        self._records.clear()
+        self._seen.clear()
+
+
+def open_baseline(path):
+    """ArchiveBaseline for path, or None if it is missing or unreadable."""
+    try:
+        return ArchiveBaseline(path)
+    except (OSError, EOFError, ValueError, KeyError):
+        return None
+
+
+def write_archive_stream(out, dirpath, records, baseline=None, delta=False):
+    """Write an archive to an open text stream as JSON Lines.
+
+    The first line is a header record, then one 'file' record per item of
+    `records` as soon as it is produced, and finally a 'summary' trailer.
+    Returns the summary dict, which includes per-stage 'timings' when
+    FPEEK_TRACE is enabled.
+
+    When the records were produced against an ArchiveBaseline, pass it as
+    `baseline` so the header and summary name it. With delta, only changes
+    against it are written: 'added' and 'modified' records, then a
+    'removed' record (relative_path only) per vanished file.
+    """
+    total_files = 0
+    total_size = 0
+    changes = {'added': 0, 'modified': 0}
+
+    with collect(f"archive {dirpath}") as timings:
+        header = {'type': 'header', 'directory': dirpath, 'generated': datetime.now().isoformat()}
+        if baseline is not None:
+            header['base'] = os.path.basename(baseline.path)
+            if delta:
+                header['delta'] = True
+        out.write(json.dumps(header) + '\n')
+
+        for record in records:
+            total_files += 1
+            total_size += record.get('size_bytes', 0)
+
+            kind = 'file'
+            if delta:
+                relative_path = record['relative_path']
+                if baseline.was_reused(relative_path):
+                    continue
+                kind = 'added' if baseline.is_new(relative_path) else 'modified'
+                changes[kind] += 1
+            with span('write'):
+                out.write(json.dumps({'type': kind, **record}) + '\n')
+
+        summary = _archive_summary(total_files, total_size, timings)
+        if baseline is not None:
+            removed = baseline.removed()
+            if delta:
+                for relative_path in removed:
+                    out.write(json.dumps({'type': 'removed', 'relative_path': relative_path}) + '\n')
+                summary.update(changes)
+            summary['reused'] = baseline.reused
+            summary['removed'] = len(removed)
+    out.write(json.dumps({'type': 'summary', **summary}) + '\n')
+    return summary
+
+
+def write_directory_archive(dirpath, archive_path, jobs=DEFAULT_JOBS, compression=None,
+                            task=None, entries=None, baseline=None, delta=False, media=False):
+    """Stream an archive of dirpath to archive_path; see write_archive_stream().
+
+    With a `baseline`, unchanged files reuse their previous records and
+    only new or modified files are hashed. With `media`, audio, video and
+    image files also get their ffprobe output.
+    """
+    records = iter_directory_records(dirpath, jobs, entries, task, exclude=(archive_path,),
+                                     baseline=baseline, media=media)
+    with open_archive_stream(archive_path, compression) as out:
+        return write_archive_stream(out, dirpath, records, baseline, delta)
+
+
+def selection_entries(paths):
+    """Return DirEntry objects for the given paths, in the given order.
+
+    Each parent directory is scanned once, however many of its children
+    are selected; paths that no longer exist are dropped.
+    """
+    paths = [os.path.abspath(p) for p in paths]
+    by_parent = {}
+    for path in paths:
+        by_parent.setdefault(os.path.dirname(path), set()).add(os.path.basename(path))
+
+    found = {}
+    for parent, names in by_parent.items():
+        try:
+            with os.scandir(parent) as it:
+                for entry in it:
+                    if entry.name in names:
+                        found[entry.path] = entry
+        except OSError:
+            continue
+    return [found[path] for path in paths if path in found]
+
+
+def iter_selection(paths, recursive=True, task=None):
+    """Yield (DirEntry, is_dir) for each selected path and, with recursive,
+    for everything below selected directories (see walk_tree())."""
+    for entry in selection_entries(paths):
+        if task:
+            task.check()
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        yield entry, is_dir
+        if is_dir and recursive:
+            yield from walk_tree(entry.path, task=task)
+        elif not is_dir and task:
+            task.add_progress(files=1)
+
+
+def selection_base(paths):
+    """Directory that archive paths of a selection are made relative to."""
+    return os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths])
+
+
+def _selection_item(item, recursive, probe_media, task=None):
+    entry, is_dir = item
+    if task:
+        task.check()
+    if is_dir:
+        return ('dir', directory_totals(entry.path, task=task) if not recursive else None)
+
+    try:
+        stat = entry.stat()
+        mime_type = get_mime_type(entry.path, stat)
+    except OSError:
+        return ('error', None)
+
+    media = None
+    if probe_media and has_duration(mime_type):
+        media = get_media_metadata(entry.path, task, mime_type, stat)
+    duration = None
+    if media is not None:
+        try:
+            duration = float(media['format']['duration'])
+        except (KeyError, ValueError):
+            pass
+    return ('file', (stat.st_size, mime_type, media is not None, duration))
+
+
+def summarize_selection(paths, jobs=DEFAULT_JOBS, recursive=True, probe_media=True, task=None):
+    """Aggregate metadata for a multi-item selection on one shared worker pool.
+
+    With recursive, selected directories are walked and every file below
+    them is typed; with probe_media, audio and video files are also probed
+    for their duration. Otherwise directories only contribute their file
+    count and size. Returns a dict with 'items', 'files', 'directories',
+    'total_size', 'types' ({mime: {'count', 'size'}}), 'media_files',
+    'media_duration' and 'unreadable'.
+    """
+    summary = {
+        'items': len(paths),
+        'files': 0,
+        'directories': 0,
+        'total_size': 0,
+        'types': {},
+        'media_files': 0,
+        'media_duration': 0.0,
+        'unreadable': 0,
+    }
+
+    items = iter_selection(paths, recursive, task)
+    jobs = max(1, jobs)
+    with collect(f"selection of {len(paths)}"), ThreadPoolExecutor(jobs) as pool:
+        results = imap_bounded(
+            pool, lambda item: _selection_item(item, recursive, probe_media, task),
+            items, jobs * 4
+        )
+        for kind, info in results:
+            if kind == 'error':
+                summary['unreadable'] += 1
+            elif kind == 'dir':
+                summary['directories'] += 1
+                if info is not None:
+                    files, dirs, size = info
+                    summary['files'] += files
+                    summary['directories'] += dirs
+                    summary['total_size'] += size
+            else:
+                size, mime_type, is_media, duration = info
+                summary['files'] += 1
+                summary['total_size'] += size
+                counts = summary['types'].setdefault(mime_type, {'count': 0, 'size': 0})
+                counts['count'] += 1
+                counts['size'] += size
+                if is_media:
+                    summary['media_files'] += 1
+                if duration:
+                    summary['media_duration'] += duration
+    return summary
+
+
+def write_selection_archive(paths, archive_path, jobs=DEFAULT_JOBS, compression=None, task=None):
+    """Stream one archive covering every selected file and directory.
 
-    return metadata
\ No newline at end of file
+    Records are relative to selection_base(paths); see write_archive_stream().
+    """
+    entries = (entry for entry, is_dir in iter_selection(paths, task=task) if not is_dir)
+    return write_directory_archive(selection_base(paths), archive_path, jobs, compression,
+                                   task, entries)
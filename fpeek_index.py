@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+"""
+Live directory-size index backed by inotify (Linux only, via ctypes).
+
+Keeps aggregate file counts, subdirectory counts and sizes for every
+directory below a set of indexed roots, so repeated Quick Peeks are
+answered from memory. The numbers match directory_totals(): symlinked
+directories are counted but not descended into, file sizes follow links.
+
+Only per-directory aggregates are stored, never per-file entries. An
+inotify event marks its directory dirty; dirty directories are re-listed
+(not re-walked) in the background and the size difference is propagated
+to their ancestors. New subdirectories are scanned and watched, removed
+ones are dropped. A full rescan only happens when the kernel event queue
+overflows.
+
+The index uses at most a fraction of fs.inotify.max_user_watches, so other
+watchers keep working. When that budget is used up, the least recently
+peeked roots are evicted; a tree too large for the whole budget is
+remembered as failed for a while and callers fall back to walking it.
+
+Enable with FPEEK_INDEX=1. Directories are indexed the first time they are
+peeked; FPEEK_INDEX_ROOTS (colon-separated) are indexed up front.
+"""
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from collections import OrderedDict
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+# Events are batched until the queue has been quiet this long (or for at
+# most EVENT_BATCH_MAX), so a burst of writes costs one re-list per directory
+EVENT_DEBOUNCE = 0.2
+EVENT_BATCH_MAX = 1.0
+# Remember sizes of recently modified files (per directory) so that a file
+# being appended to does not re-list its whole directory on every write
+HOT_FILES_PER_DIR = 64
+# Share of fs.inotify.max_user_watches the index may use, and a hard cap
+# (FPEEK_INDEX_WATCHES overrides the cap)
+WATCH_BUDGET_FRACTION = 0.25
+MAX_WATCHES = int(os.environ.get('FPEEK_INDEX_WATCHES', 65536))
+MAX_ROOTS = 32
+# Trees that did not fit are not retried for this long (seconds)
+FAILED_RETRY = 3600
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError, TypeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+class WatchLimitReached(OSError):
+    pass
+
+
+class _Node:
+    """Counts for one directory: its own entries and the whole subtree."""
+
+    __slots__ = ('files', 'dirs', 'size', 'children', 'total_files', 'total_dirs', 'total_size',
+                 'hot')
+
+    def __init__(self, files, dirs, size, children):
+        self.files = files
+        self.dirs = dirs
+        self.size = size
+        self.children = children
+        self.total_files = files
+        self.total_dirs = dirs
+        self.total_size = size
+        self.hot = None
+
+
+def _list_directory(path):
+    """Return (files, dirs, size, child directory names) for path's own entries."""
+    files = dirs = size = 0
+    children = set()
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    dirs += 1
+                    if not entry.is_symlink():
+                        children.add(entry.name)
+                    continue
+                files += 1
+                try:
+                    size += entry.stat().st_size
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return files, dirs, size, children
+
+
+def _watch_budget():
+    try:
+        with open('/proc/sys/fs/inotify/max_user_watches') as f:
+            limit = int(f.read())
+    except (OSError, ValueError):
+        limit = 8192
+    return max(1, min(MAX_WATCHES, int(limit * WATCH_BUDGET_FRACTION)))
+
+
+def _under(path, root):
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def _file_size(path):
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return 0
+
+
+class DirectoryIndex:
+    def __init__(self):
+        if _libc is None:
+            raise OSError("inotify is not available")
+        self._fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self._lock = threading.RLock()
+        self._nodes = {}
+        # Indexed roots, least recently used first
+        self._roots = OrderedDict()
+        self._wd_paths = {}
+        self._path_wds = {}
+        self._budget = _watch_budget()
+        # root being scanned -> directories that had events during the scan
+        self._scanning = {}
+        self._overflowed = set()
+        # root -> time.monotonic() when it did not fit
+        self._failed = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='fpeek-index', daemon=True)
+        self._thread.start()
+
+    # Queries
+
+    def totals(self, path):
+        """Return (files, subdirectories, size) for an indexed directory, or None."""
+        path = os.path.abspath(path)
+        with self._lock:
+            node = self._nodes.get(path)
+            if node is None:
+                return None
+            self._roots.move_to_end(self._root_of(path))
+            return node.total_files, node.total_dirs, node.total_size
+
+    def add_root(self, path):
+        """Index the tree at path and return its totals.
+
+        Returns None if the tree could not be watched within the watch
+        budget (now or recently) or is being indexed by another thread;
+        the caller should walk it instead.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            if path in self._nodes:
+                return self.totals(path)
+            now = time.monotonic()
+            self._failed = {root: since for root, since in self._failed.items()
+                            if now - since < FAILED_RETRY}
+            # A tree containing one that did not fit cannot fit either
+            if any(_under(root, path) for root in self._failed):
+                return None
+            if any(_under(path, root) or _under(root, path) for root in self._scanning):
+                return None
+            self._scanning[path] = set()
+
+        # Listing happens without the lock, so the event thread keeps
+        # draining the kernel queue meanwhile; watches are added under it
+        nodes = {}
+        created = []
+        try:
+            self._scan(path, nodes, path, created)
+        except WatchLimitReached:
+            with self._lock:
+                del self._scanning[path]
+                self._overflowed.discard(path)
+                for watched in created:
+                    self._unwatch(watched)
+                self._failed[path] = time.monotonic()
+            return None
+
+        with self._lock:
+            late = self._scanning.pop(path)
+            if path in self._overflowed:
+                self._overflowed.discard(path)
+                late = set(nodes)
+            # Roots inside the new one become part of it
+            for root in [root for root in self._roots if _under(root, path)]:
+                del self._roots[root]
+            self._nodes.update(nodes)
+            self._roots[path] = None
+            # Catch up on directories that changed while they were listed
+            for dirty in sorted(late, key=len):
+                self._refresh(dirty)
+            while len(self._roots) > MAX_ROOTS:
+                self._evict(keep=path)
+            node = self._nodes[path]
+            return node.total_files, node.total_dirs, node.total_size
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        os.close(self._fd)
+
+    # Watches and tree maintenance (called with the lock held, except
+    # for the listing part of _scan() during add_root())
+
+    def _watch(self, path, keep, created=None):
+        """Watch path, evicting roots other than `keep` to stay in budget."""
+        with self._lock:
+            if path in self._path_wds:
+                return
+            while len(self._path_wds) >= self._budget:
+                if not self._evict(keep):
+                    raise WatchLimitReached(errno.ENOSPC, "fpeek watch budget reached", path)
+            wd = _libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    raise WatchLimitReached(err, "inotify watch limit reached", path)
+                # Vanished or unreadable: counted like directory_totals() would
+                return
+            self._wd_paths[wd] = path
+            self._path_wds[path] = wd
+            if created is not None:
+                created.append(path)
+
+    def _evict(self, keep):
+        """Drop the least recently used root not containing or inside `keep`."""
+        for root in self._roots:
+            if not _under(root, keep) and not _under(keep, root):
+                del self._roots[root]
+                self._drop(root)
+                return True
+        return False
+
+    def _unwatch(self, path):
+        wd = self._path_wds.pop(path, None)
+        # A moved directory keeps its watch descriptor; only remove the
+        # watch if it still belongs to this path
+        if wd is not None and self._wd_paths.get(wd) == path:
+            del self._wd_paths[wd]
+            _libc.inotify_rm_watch(self._fd, wd)
+
+    def _scan(self, root, nodes, keep, created=None):
+        """Watch and list every directory below root into `nodes`; returns
+        root's node. `keep` is the indexed root this subtree belongs to."""
+        order = []
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            # Watch before listing so no change between the two is missed
+            self._watch(path, keep, created)
+            node = _Node(*_list_directory(path))
+            nodes[path] = node
+            order.append(path)
+            stack.extend(os.path.join(path, name) for name in node.children)
+
+        for path in reversed(order):
+            node = nodes[path]
+            for name in node.children:
+                child = nodes[os.path.join(path, name)]
+                node.total_files += child.total_files
+                node.total_dirs += child.total_dirs
+                node.total_size += child.total_size
+        return nodes[root]
+
+    def _drop(self, root):
+        """Forget root and everything below it; returns its old node."""
+        dropped = self._nodes.get(root)
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            self._unwatch(path)
+            node = self._nodes.pop(path, None)
+            if node is not None:
+                stack.extend(os.path.join(path, name) for name in node.children)
+        return dropped
+
+    def _propagate(self, path, files, dirs, size):
+        """Add the given differences to path and its indexed ancestors."""
+        while True:
+            node = self._nodes.get(path)
+            if node is None:
+                return
+            node.total_files += files
+            node.total_dirs += dirs
+            node.total_size += size
+            if path in self._roots:
+                return
+            path = os.path.dirname(path)
+
+    def _refresh(self, path, modified=()):
+        """Re-list one directory and apply what changed to the totals."""
+        node = self._nodes.get(path)
+        if node is None:
+            self._defer(path)
+            return
+        files, dirs, size, children = _list_directory(path)
+        d_files = files - node.files
+        d_dirs = dirs - node.dirs
+        d_size = size - node.size
+
+        for name in node.children - children:
+            child = self._drop(os.path.join(path, name))
+            if child is not None:
+                d_files -= child.total_files
+                d_dirs -= child.total_dirs
+                d_size -= child.total_size
+        for name in children - node.children:
+            try:
+                child = self._scan(os.path.join(path, name), self._nodes, self._root_of(path))
+            except WatchLimitReached:
+                # Cannot keep this tree live any more; forget it entirely,
+                # including the new subdirectories not linked to it yet
+                for new in children - node.children:
+                    self._drop(os.path.join(path, new))
+                self._drop_root_of(path)
+                return
+            d_files += child.total_files
+            d_dirs += child.total_dirs
+            d_size += child.total_size
+
+        node.files, node.dirs, node.size, node.children = files, dirs, size, children
+        node.hot = {name: _file_size(os.path.join(path, name))
+                    for name in list(modified)[:HOT_FILES_PER_DIR]} or None
+        self._propagate(path, d_files, d_dirs, d_size)
+
+    def _refresh_files(self, path, names):
+        """Apply size changes of modified files, re-listing only if needed."""
+        node = self._nodes.get(path)
+        if node is None:
+            self._defer(path)
+            return
+        if node.hot is None or not names.issubset(node.hot):
+            self._refresh(path, names)
+            return
+        d_size = 0
+        for name in names:
+            size = _file_size(os.path.join(path, name))
+            d_size += size - node.hot[name]
+            node.hot[name] = size
+        node.size += d_size
+        self._propagate(path, 0, 0, d_size)
+
+    def _defer(self, path):
+        """Remember a change below a root that add_root() is still scanning."""
+        for root, late in self._scanning.items():
+            if _under(path, root):
+                late.add(path)
+                return
+
+    def _root_of(self, path):
+        while path not in self._roots:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+        return path
+
+    def _drop_root_of(self, path):
+        root = self._root_of(path)
+        if root is not None:
+            del self._roots[root]
+            self._drop(root)
+            self._failed[root] = time.monotonic()
+
+    def _rescan_all(self):
+        for root in list(self._roots):
+            self._drop(root)
+            try:
+                self._scan(root, self._nodes, root)
+            except WatchLimitReached:
+                self._drop(root)
+                self._roots.pop(root, None)
+                self._failed[root] = time.monotonic()
+        # Directories already listed by a running add_root() may have
+        # missed events too; it re-lists all of them before merging
+        self._overflowed.update(self._scanning)
+
+    # Event loop
+
+    def _read_events(self, dirty, modified):
+        """Read queued events into dirty/modified; returns True on overflow."""
+        overflow = False
+        while True:
+            try:
+                data = os.read(self._fd, READ_SIZE)
+            except BlockingIOError:
+                return overflow
+            if not data:
+                return overflow
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + _EVENT.size:offset + _EVENT.size + length]
+                                   .rstrip(b'\0'))
+                offset += _EVENT.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                with self._lock:
+                    path = self._wd_paths.get(wd)
+                    if path is None:
+                        continue
+                    if mask & IN_IGNORED:
+                        del self._wd_paths[wd]
+                        if self._path_wds.get(path) == wd:
+                            del self._path_wds[path]
+                        continue
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                        # The parent sees the matching entry event; a root
+                        # has no indexed parent, so stop indexing it
+                        if path in self._roots:
+                            del self._roots[path]
+                            self._drop(path)
+                        continue
+                if mask & IN_MODIFY and not mask & IN_ISDIR:
+                    modified.setdefault(path, set()).add(name)
+                else:
+                    dirty.add(path)
+
+    def _run(self):
+        poller = select.poll()
+        poller.register(self._fd, select.POLLIN)
+        while not self._stop.is_set():
+            if not poller.poll(500):
+                continue
+
+            dirty = set()
+            modified = {}
+            overflow = self._read_events(dirty, modified)
+            waited = 0.0
+            while waited < EVENT_BATCH_MAX and poller.poll(int(EVENT_DEBOUNCE * 1000)):
+                overflow |= self._read_events(dirty, modified)
+                waited += EVENT_DEBOUNCE
+
+            with self._lock:
+                if overflow:
+                    self._rescan_all()
+                    continue
+                # Parents first, so dropped subtrees are not refreshed in vain
+                for path in sorted(dirty, key=len):
+                    self._refresh(path, modified.pop(path, ()))
+                for path, names in modified.items():
+                    self._refresh_files(path, names)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_directory_index():
+    """Return the shared DirectoryIndex, or None if it is disabled or unavailable."""
+    global _index
+    if os.environ.get('FPEEK_INDEX', '0') in ('', '0'):
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                try:
+                    _index = DirectoryIndex()
+                except OSError:
+                    _index = False
+                else:
+                    roots = [r for r in os.environ.get('FPEEK_INDEX_ROOTS', '').split(':') if r]
+                    if roots:
+                        threading.Thread(target=_warm_up, args=(_index, roots),
+                                         name='fpeek-index-warmup', daemon=True).start()
+    return _index or None
+
+
+def _warm_up(index, roots):
+    for root in roots:
+        root = os.path.expanduser(root)
+        if os.path.isdir(root):
+            index.add_root(root)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+In-process MIME type detection.
+
+Uses libmagic through ctypes when it is installed (it ships with `file`),
+otherwise a small magic-byte sniffer, and finally the file extension. Only
+the first MIME_SNIFF_SIZE bytes of each file are read.
+"""
+
+import os
+import stat as stat_module
+import ctypes
+import ctypes.util
+import mimetypes
+import threading
+
+MIME_SNIFF_SIZE = 16 * 1024
+
+MAGIC_SYMLINK = 0x000002
+MAGIC_MIME_TYPE = 0x000010
+MAGIC_ERROR = 0x000200
+
+
+def _load_libmagic():
+    name = ctypes.util.find_library('magic')
+    if not name:
+        return None
+    try:
+        lib = ctypes.CDLL(name)
+    except OSError:
+        return None
+
+    lib.magic_open.restype = ctypes.c_void_p
+    lib.magic_open.argtypes = [ctypes.c_int]
+    lib.magic_load.restype = ctypes.c_int
+    lib.magic_load.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+    lib.magic_buffer.restype = ctypes.c_char_p
+    lib.magic_buffer.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+    lib.magic_close.restype = None
+    lib.magic_close.argtypes = [ctypes.c_void_p]
+    return lib
+
+
+_libmagic = _load_libmagic()
+
+
+class _MagicCookie:
+    """A libmagic handle; these are not thread-safe, so one per thread."""
+
+    def __init__(self):
+        self._lib = _libmagic
+        self.handle = self._lib.magic_open(MAGIC_MIME_TYPE | MAGIC_SYMLINK | MAGIC_ERROR)
+        if not self.handle or self._lib.magic_load(self.handle, None) != 0:
+            self.close()
+            raise OSError("Could not load the libmagic database")
+
+    def detect(self, head):
+        result = self._lib.magic_buffer(self.handle, head, len(head))
+        return result.decode('utf-8', 'replace') if result else None
+
+    def close(self):
+        if self.handle:
+            self._lib.magic_close(self.handle)
+            self.handle = None
+
+    def __del__(self):
+        self.close()
+
+
+_local = threading.local()
+
+
+def _cookie():
+    if _libmagic is None:
+        return None
+    cookie = getattr(_local, 'cookie', None)
+    if cookie is None:
+        try:
+            cookie = _local.cookie = _MagicCookie()
+        except OSError:
+            return None
+    return cookie
+
+
+# (offset, signature, MIME type); checked in order
+_SIGNATURES = [
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (0, b'8BPS', 'image/vnd.adobe.photoshop'),
+    (0, b'\x00\x00\x01\x00', 'image/vnd.microsoft.icon'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (0, b'BZh', 'application/x-bzip2'),
+    (0, b'\xfd7zXZ\x00', 'application/x-xz'),
+    (0, b'(\xb5/\xfd', 'application/zstd'),
+    (0, b"7z\xbc\xaf'\x1c", 'application/x-7z-compressed'),
+    (0, b'Rar!\x1a\x07', 'application/x-rar'),
+    (257, b'ustar', 'application/x-tar'),
+    (0, b'\x7fELF', 'application/x-executable'),
+    (0, b'SQLite format 3\x00', 'application/vnd.sqlite3'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'\xff\xfb', 'audio/mpeg'),
+    (0, b'\xff\xf3', 'audio/mpeg'),
+    (0, b'fLaC', 'audio/flac'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'MThd', 'audio/midi'),
+    (0, b'\x1aE\xdf\xa3', 'video/x-matroska'),
+]
+
+_RIFF_TYPES = {b'WAVE': 'audio/x-wav', b'AVI ': 'video/x-msvideo', b'WEBP': 'image/webp'}
+
+# BITMAPCOREHEADER, BITMAPINFOHEADER, the V2/V3 info headers, OS/2 v2, V4, V5
+_BMP_DIB_SIZES = {12, 40, 52, 56, 64, 108, 124}
+
+_FTYP_BRANDS = {
+    b'qt  ': 'video/quicktime',
+    b'M4A ': 'audio/x-m4a',
+    b'heic': 'image/heic',
+    b'heix': 'image/heic',
+    b'avif': 'image/avif',
+}
+
+
+def _is_bmp(head):
+    """'BM' alone matches plain text too; also check the header fields."""
+    if len(head) < 18 or head[:2] != b'BM':
+        return False
+    file_size = int.from_bytes(head[2:6], 'little')
+    dib_size = int.from_bytes(head[14:18], 'little')
+    return dib_size in _BMP_DIB_SIZES and file_size >= 14 + dib_size
+
+
+def sniff_mime_type(head):
+    """Guess a MIME type from the first bytes of a file, or return None."""
+    if not head:
+        return 'application/x-empty'
+
+    for offset, signature, mime_type in _SIGNATURES:
+        if head.startswith(signature, offset):
+            if mime_type == 'video/x-matroska' and b'webm' in head[:64]:
+                return 'video/webm'
+            return mime_type
+
+    if _is_bmp(head):
+        return 'image/bmp'
+    if head[:4] == b'RIFF' and head[8:12] in _RIFF_TYPES:
+        return _RIFF_TYPES[head[8:12]]
+    if head[4:8] == b'ftyp':
+        return _FTYP_BRANDS.get(head[8:12], 'video/mp4')
+
+    if b'\x00' not in head:
+        try:
+            # A multi-byte character may be cut off at the end of the sample
+            head[:-4].decode('utf-8')
+            return 'text/plain'
+        except UnicodeDecodeError:
+            pass
+    return None
+
+
+_SPECIAL_TYPES = [
+    (stat_module.S_ISDIR, 'inode/directory'),
+    (stat_module.S_ISFIFO, 'inode/fifo'),
+    (stat_module.S_ISSOCK, 'inode/socket'),
+    (stat_module.S_ISCHR, 'inode/chardevice'),
+    (stat_module.S_ISBLK, 'inode/blockdevice'),
+]
+
+
+def _read_head(filepath):
+    with open(filepath, 'rb') as f:
+        return f.read(MIME_SNIFF_SIZE)
+
+
+def detect_mime_type(filepath, stat=None, cookie=None):
+    """Detect the MIME type of a file without spawning `file`."""
+    try:
+        mode = (stat or os.stat(filepath)).st_mode
+        for check, mime_type in _SPECIAL_TYPES:
+            if check(mode):
+                return mime_type
+        head = _read_head(filepath)
+    except OSError:
+        return 'unknown'
+
+    cookie = cookie or _cookie()
+    if cookie is not None:
+        mime_type = cookie.detect(head)
+        if mime_type:
+            return mime_type
+
+    mime_type = sniff_mime_type(head)
+    if mime_type and mime_type != 'text/plain':
+        return mime_type
+
+    guessed, _ = mimetypes.guess_type(filepath, strict=False)
+    return guessed or mime_type or 'application/octet-stream'
+
+
+def detect_mime_types(filepaths):
+    """Detect MIME types for many files, reusing one libmagic handle."""
+    cookie = _cookie()
+    return [detect_mime_type(filepath, cookie=cookie) for filepath in filepaths]
@@ -7,20 +7,37 @@ Shows detailed file metadata in context menu
 import gi
 gi.require_version('Nautilus', '4.1')
 
-from gi.repository import Nautilus, GObject
+from gi.repository import Nautilus, GObject, GLib
 import os
 import subprocess
-from fpeek_common import get_file_metadata, format_size, get_media_metadata
+from fpeek_common import (
+    get_file_metadata, format_size, get_media_metadata, directory_totals, run_in_background,
+    summarize_selection,
+)
+from fpeek_index import get_directory_index
+
+SELECTION_TYPES_SHOWN = 5
 
 
 class FpeekExtension(GObject.GObject, Nautilus.MenuProvider):
     def __init__(self):
         super().__init__()
+        # Starts the live size index (and its warm-up) when FPEEK_INDEX is set
+        get_directory_index()
 
     def get_file_items(self, files):
-        if len(files) != 1:
+        if not files:
             return []
 
+        if len(files) > 1:
+            item = Nautilus.MenuItem(
+                name='FpeekExtension::QuickPeekSelection',
+                label=f'Quick Peek ({len(files)} items)',
+                tip='Combined size and type breakdown of the selection'
+            )
+            item.connect('activate', self.on_peek_selection_click, files)
+            return [item]
+
         file_info = files[0]
 
         item = Nautilus.MenuItem(
@@ -33,25 +50,12 @@ class FpeekExtension(GObject.GObject, Nautilus.MenuProvider):
         return [item]
 
     def count_directory_contents(self, dirpath):
-        total_files = 0
-        total_dirs = 0
-        total_size = 0
-
-        try:
-            for root, dirs, files in os.walk(dirpath):
-                total_dirs += len(dirs)
-                total_files += len(files)
-
-                for filename in files:
-                    try:
-                        filepath = os.path.join(root, filename)
-                        total_size += os.path.getsize(filepath)
-                    except (OSError, PermissionError):
-                        pass
-        except (OSError, PermissionError):
-            pass
-
-        return total_files, total_dirs, total_size
+        index = get_directory_index()
+        if index is not None:
+            totals = index.totals(dirpath) or index.add_root(dirpath)
+            if totals is not None:
+                return totals
+        return directory_totals(dirpath)
 
     def peek_directory(self, dirpath):
         try:
@@ -69,7 +73,7 @@ class FpeekExtension(GObject.GObject, Nautilus.MenuProvider):
     def peek_file(self, filepath):
         try:
             metadata = get_file_metadata(filepath)
-            media_info = get_media_metadata(filepath)
+            media_info = get_media_metadata(filepath, mime_type=metadata['mime_type'])
 
             preview = f"File: {metadata['filename']}\n\n"
             preview += f"Size: {metadata['size_human']}\n"
@@ -106,14 +110,52 @@ class FpeekExtension(GObject.GObject, Nautilus.MenuProvider):
             ])
             return
 
-        if os.path.isdir(file_path):
-            preview = self.peek_directory(file_path)
-        else:
-            preview = self.peek_file(file_path)
+        def work(task):
+            if os.path.isdir(file_path):
+                return self.peek_directory(file_path)
+            return self.peek_file(file_path)
+
+        run_in_background(work, self.on_peek_done, GLib.idle_add)
+
+    def on_peek_done(self, preview, error):
+        if error is not None:
+            preview = f"Error: {str(error)}"
 
-        subprocess.run([
+        subprocess.Popen([
             'notify-send',
             'Quick Peek',
             preview,
             '-t', '8000'
-        ])
\ No newline at end of file
+        ])
+
+    def on_peek_selection_click(self, menu, files):
+        paths = [f.get_location().get_path() for f in files]
+        paths = [p for p in paths if p]
+
+        def work(task):
+            return self.peek_selection(paths)
+
+        run_in_background(work, self.on_peek_done, GLib.idle_add)
+
+    def peek_selection(self, paths):
+        # Directories are only sized, not typed, to keep this a quick peek
+        summary = summarize_selection(paths, recursive=False)
+
+        preview = f"Selection: {summary['items']} items\n\n"
+        preview += f"Files: {summary['files']}\n"
+        preview += f"Directories: {summary['directories']}\n"
+        preview += f"Total Size: {format_size(summary['total_size'])}\n"
+
+        types = sorted(summary['types'].items(), key=lambda t: t[1]['count'], reverse=True)
+        if types:
+            preview += "\n"
+            for mime_type, counts in types[:SELECTION_TYPES_SHOWN]:
+                preview += f"{mime_type}: {counts['count']} ({format_size(counts['size'])})\n"
+            if len(types) > SELECTION_TYPES_SHOWN:
+                preview += f"... and {len(types) - SELECTION_TYPES_SHOWN} more types\n"
+
+        if summary['media_files']:
+            minutes = int(summary['media_duration'] // 60)
+            seconds = int(summary['media_duration'] % 60)
+            preview += f"\nMedia: {summary['media_files']} files, {minutes}m {seconds}s\n"
+        return preview
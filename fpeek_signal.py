@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+"""
+Spectral analysis of discrete signals (audio tracks, images) for fpeek.
+
+Everything here works on bounded memory: audio is decoded by ffmpeg into a
+pipe and consumed frame by frame, images are decoded at reduced scale and
+transformed in tiles, and results are pooled down to a fixed resolution
+however large the input is.
+"""
+
+import math
+import subprocess
+import threading
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Bump when rendering changes so cached graphs are regenerated
+GRAPH_VERSION = 3
+
+AUDIO_SAMPLE_RATE = 8000
+STFT_SIZE = 512
+STFT_HOP = 256
+STFT_BATCH_HOPS = 1024
+SPECTROGRAM_COLUMNS = 1600
+
+IMAGE_MAX_PIXELS = 16 * 1024 * 1024
+FFT_MAX_PIXELS = 1024 * 1024
+DCT_BLOCK_SIZE = 8
+DCT_TILE_ROWS = 256
+
+# Bump when perceptual hashing changes so cached fingerprints are recomputed
+PHASH_VERSION = 2
+PHASH_MAX_PIXELS = 512 * 512
+PHASH_IMAGE_SIZE = 32
+PHASH_SIZE = 8
+
+# Graphs are rendered on worker threads, and matplotlib's text layout
+# (mathtext tick labels in particular) shares parser state between figures
+_RENDER_LOCK = threading.Lock()
+
+
+class BoundedSeries:
+    """Fixed-size accumulator for a stream of rows.
+
+    Rows are reduced into at most max_len slots with `ufunc` (np.add for
+    means, np.minimum/np.maximum for envelopes). Whenever the stream
+    outgrows the slots, neighbouring slots are merged pairwise and every
+    slot covers twice as many input rows from then on.
+    """
+
+    def __init__(self, max_len, width, ufunc=np.add, mean=False):
+        self.max_len = max_len - max_len % 2
+        self.ufunc = ufunc
+        self.mean = mean
+        self.identity = 0.0 if ufunc is np.add else (np.inf if ufunc is np.minimum else -np.inf)
+        self.data = np.full((self.max_len, width), self.identity, dtype=np.float64)
+        self.counts = np.zeros(self.max_len, dtype=np.int64)
+        self.factor = 1
+        self.total = 0
+
+    def _halve(self):
+        half = self.max_len // 2
+        self.data[:half] = self.ufunc(self.data[0::2], self.data[1::2])
+        self.data[half:] = self.identity
+        self.counts[:half] = self.counts[0::2] + self.counts[1::2]
+        self.counts[half:] = 0
+        self.factor *= 2
+
+    def add(self, rows):
+        n = len(rows)
+        if not n:
+            return
+        while (self.total + n - 1) // self.factor >= self.max_len:
+            self._halve()
+
+        slots = np.arange(self.total, self.total + n) // self.factor
+        starts = np.flatnonzero(np.r_[True, slots[1:] != slots[:-1]])
+        targets = slots[starts]
+        self.data[targets] = self.ufunc(self.data[targets], self.ufunc.reduceat(rows, starts, axis=0))
+        self.counts[targets] += np.diff(np.r_[starts, n])
+        self.total += n
+
+    def values(self):
+        used = (self.total + self.factor - 1) // self.factor
+        data = self.data[:used]
+        if self.mean:
+            return data / np.maximum(self.counts[:used], 1)[:, None]
+        return data.copy()
+
+
+def stream_spectrogram(filepath, sample_rate=AUDIO_SAMPLE_RATE, n_fft=STFT_SIZE,
+                       hop=STFT_HOP, max_columns=SPECTROGRAM_COLUMNS, task=None):
+    """Decode the first audio stream of filepath and compute its STFT.
+
+    ffmpeg writes mono s16le samples to a pipe which is consumed in batches
+    of STFT_BATCH_HOPS hops; each batch becomes one vectorized rfft over a
+    strided view of Hann-windowed frames. Memory use is independent of the
+    track length. Returns a dict with the power spectrogram in dB
+    (columns x frequency bins), its frequency and time axes, and a min/max
+    amplitude envelope at the same time resolution.
+    """
+    proc = subprocess.Popen(
+        ['ffmpeg', '-nostdin', '-v', 'error', '-i', filepath, '-vn',
+         '-ac', '1', '-ar', str(sample_rate), '-f', 's16le', '-'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+
+    window = np.hanning(n_fft).astype(np.float32)
+    spectrum = BoundedSeries(max_columns, n_fft // 2 + 1, np.add, mean=True)
+    env_min = BoundedSeries(max_columns, 1, np.minimum)
+    env_max = BoundedSeries(max_columns, 1, np.maximum)
+
+    read_size = hop * STFT_BATCH_HOPS * 2
+    carry = np.zeros(0, dtype=np.float32)
+    total_samples = 0
+
+    try:
+        while True:
+            if task:
+                task.check()
+            data = proc.stdout.read(read_size)
+            if not data:
+                break
+            samples = np.frombuffer(data[:len(data) // 2 * 2], dtype='<i2').astype(np.float32)
+            samples /= 32768.0
+            total_samples += len(samples)
+            if task:
+                task.add_progress(nbytes=len(data))
+
+            buf = np.concatenate((carry, samples))
+            if len(buf) < n_fft:
+                carry = buf
+                continue
+
+            frames = sliding_window_view(buf, n_fft)[::hop]
+            power = np.abs(np.fft.rfft(frames * window, axis=1)) ** 2
+            spectrum.add(power)
+
+            hops = frames[:, :hop]
+            env_min.add(hops.min(axis=1, keepdims=True))
+            env_max.add(hops.max(axis=1, keepdims=True))
+
+            carry = buf[len(frames) * hop:]
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+        proc.wait()
+
+    if spectrum.total == 0:
+        raise RuntimeError("No audio could be decoded")
+
+    power = spectrum.values()
+    columns = len(power)
+    duration = total_samples / sample_rate
+    return {
+        'spectrogram_db': 10 * np.log10(power + 1e-12),
+        'frequencies': np.fft.rfftfreq(n_fft, 1 / sample_rate),
+        'times': (np.arange(columns) + 0.5) * spectrum.factor * hop / sample_rate,
+        'envelope_min': env_min.values()[:, 0],
+        'envelope_max': env_max.values()[:, 0],
+        'duration': duration,
+        'sample_rate': sample_rate,
+    }
+
+
+def new_figure(**kwargs):
+    """A figure with its own Agg canvas, kept out of pyplot's global
+    figure registry so concurrent renders cannot save each other's figures."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def render_audio_graph(result, output_path):
+    with _RENDER_LOCK:
+        fig = new_figure(figsize=(12, 7), constrained_layout=True)
+        ax_env, ax_spec = fig.subplots(2, 1, sharex=True, gridspec_kw={'height_ratios': [1, 2]})
+        fig.suptitle('Audio Analysis')
+
+        times = result['times']
+        ax_env.fill_between(times, result['envelope_min'], result['envelope_max'], linewidth=0.5)
+        ax_env.set_title('Waveform Envelope')
+        ax_env.set_ylabel('Amplitude')
+        ax_env.set_ylim(-1, 1)
+        ax_env.grid(True, alpha=0.3)
+
+        spec = result['spectrogram_db']
+        vmax = spec.max()
+        image = ax_spec.imshow(
+            spec.T, origin='lower', aspect='auto', cmap='magma',
+            extent=[0, result['duration'], 0, result['frequencies'][-1]],
+            vmin=vmax - 90, vmax=vmax
+        )
+        ax_spec.set_title('Spectrogram')
+        ax_spec.set_xlabel('Time (seconds)')
+        ax_spec.set_ylabel('Frequency (Hz)')
+        fig.colorbar(image, ax=[ax_env, ax_spec], label='Power (dB)')
+
+        fig.savefig(output_path, dpi=100, bbox_inches='tight')
+
+
+def open_image_scaled(filepath, max_pixels=IMAGE_MAX_PIXELS, mode='L'):
+    """Open an image in `mode`, decoded at reduced scale if it is larger
+    than max_pixels.
+
+    JPEGs are downscaled inside the decoder via draft(); other formats are
+    shrunk with reduce() right after decoding, before any float conversion.
+    High-bit-depth samples are scaled to 8 bits rather than clipped.
+    """
+    from PIL import Image
+
+    img = Image.open(filepath)
+    width, height = img.size
+    if width * height > max_pixels:
+        scale = math.sqrt(max_pixels / (width * height))
+        img.draft(mode, (max(1, int(width * scale)), max(1, int(height * scale))))
+
+    img = to_8bit(img)
+    if img.mode != mode:
+        img = img.convert(mode)
+    return reduce_image(img, max_pixels)
+
+
+def to_8bit(img):
+    """Scale 16-bit, 32-bit integer and float samples down to 8 bits.
+
+    convert('L') clips them at 255, which turns most high-bit-depth scans
+    white. 16-bit samples keep their high byte; 32-bit integer and float
+    images are stretched from their own value range.
+    """
+    if img.mode.startswith('I;16'):
+        return img.convert('I').point(lambda v: v / 256).convert('L')
+    if img.mode in ('I', 'F'):
+        low, high = img.getextrema()
+        if img.mode == 'I' and low >= 0 and high <= 255:
+            return img.convert('L')
+        scale = 255 / (high - low) if high > low else 0
+        return img.point(lambda v: (v - low) * scale).convert('L')
+    return img
+
+
+def reduce_image(img, max_pixels):
+    pixels = img.size[0] * img.size[1]
+    if pixels > max_pixels:
+        img = img.reduce(math.ceil(math.sqrt(pixels / max_pixels)))
+    return img
+
+
+def dct_matrix(n):
+    """Orthonormal DCT-II matrix, so that C @ x is the DCT of x."""
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * math.sqrt(2 / n)
+    matrix[0] /= math.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+_PHASH_DCT = dct_matrix(PHASH_IMAGE_SIZE)
+
+
+def block_view(array, block):
+    """View a 2D array as (rows, cols, block, block) tiles without copying;
+    edge pixels that do not fill a whole block are dropped."""
+    rows, cols = array.shape[0] // block, array.shape[1] // block
+    array = array[:rows * block, :cols * block]
+    return np.lib.stride_tricks.as_strided(
+        array,
+        shape=(rows, cols, block, block),
+        strides=(array.strides[0] * block, array.strides[1] * block) + array.strides,
+        writeable=False
+    )
+
+
+def block_dct_energy(gray, block=DCT_BLOCK_SIZE, tile_rows=DCT_TILE_ROWS):
+    """Mean absolute blockwise DCT coefficient at each (u, v) frequency.
+
+    gray is a 2D uint8 array. Rows are processed in tiles of tile_rows
+    blocks; each tile is one batched C @ B @ C.T over all of its blocks.
+    """
+    matrix = dct_matrix(block)
+    blocks = block_view(gray, block)
+    total = np.zeros((block, block), dtype=np.float64)
+    count = blocks.shape[0] * blocks.shape[1]
+    if count == 0:
+        return total
+
+    for start in range(0, blocks.shape[0], tile_rows):
+        tile = blocks[start:start + tile_rows].astype(np.float32) - 128.0
+        coefficients = matrix @ tile @ matrix.T
+        total += np.abs(coefficients).sum(axis=(0, 1), dtype=np.float64)
+    return total / count
+
+
+def radial_power_spectrum(power):
+    """Average a centred 2D power spectrum over rings of equal frequency.
+
+    Returns (normalized frequency 0..0.5, mean power per ring).
+    """
+    height, width = power.shape
+    y, x = np.ogrid[:height, :width]
+    fy = (y - height // 2) / height
+    fx = (x - width // 2) / width
+    radius = np.sqrt(fx * fx + fy * fy)
+
+    bins = max(height, width) // 2
+    index = np.minimum((radius * 2 * bins).astype(np.int64), 2 * bins).ravel()
+    sums = np.bincount(index, weights=power.ravel())
+    counts = np.bincount(index)
+    keep = slice(0, bins)
+    radial = sums[keep] / np.maximum(counts[keep], 1)
+    return np.arange(bins) / (2 * bins), radial
+
+
+def image_spectrum(img, original_size=None, max_pixels=IMAGE_MAX_PIXELS, block=DCT_BLOCK_SIZE):
+    """Spectral summary of a decoded image's luminance.
+
+    Returns the log-magnitude 2D FFT (computed on a copy reduced to at most
+    FFT_MAX_PIXELS), the blockwise DCT energy map and the radial power
+    spectrum. Pixel data only ever exists as uint8 at max_pixels, plus one
+    float32 tile at a time.
+    """
+    gray = img if img.mode == 'L' else img.convert('L')
+    gray = reduce_image(gray, max_pixels)
+    dct_energy = block_dct_energy(np.asarray(gray), block)
+
+    small = np.asarray(reduce_image(gray, FFT_MAX_PIXELS), dtype=np.float32)
+    small = small - small.mean()
+    spectrum = np.fft.fftshift(np.fft.fft2(small))
+    power = np.abs(spectrum) ** 2
+    radial_frequency, radial_power = radial_power_spectrum(power)
+
+    return {
+        'size': original_size or img.size,
+        'analysed_size': gray.size,
+        'fft_log_magnitude': np.log1p(np.sqrt(power)).astype(np.float32),
+        'dct_energy': dct_energy,
+        'radial_frequency': radial_frequency,
+        'radial_power': radial_power,
+    }
+
+
+def perceptual_hash(filepath, max_pixels=PHASH_MAX_PIXELS):
+    """64-bit DCT perceptual hash of an image, or None if it cannot be decoded.
+
+    The image is decoded at reduced scale, shrunk to 32x32 grayscale and
+    transformed; each bit says whether one of the 8x8 lowest-frequency
+    coefficients is above their median. Resized or recompressed copies of
+    an image differ in only a few bits, compared with hamming_distance().
+    """
+    from PIL import Image
+
+    try:
+        img = open_image_scaled(filepath, max_pixels, 'L')
+        img = img.resize((PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), Image.LANCZOS)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+    pixels = np.asarray(img, dtype=np.float32)
+    low = (_PHASH_DCT @ pixels @ _PHASH_DCT.T)[:PHASH_SIZE, :PHASH_SIZE].ravel()
+    # The DC term only follows overall brightness, so it stays out of the median
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def histogram_mode(img):
+    """(mode, channel names) an image is binned in."""
+    if img.mode in ('1', 'L', 'LA', 'La') or img.mode.startswith('I') or img.mode == 'F':
+        return 'L', ('gray',)
+    return 'RGB', ('red', 'green', 'blue')
+
+
+def decode_image(filepath, max_pixels=IMAGE_MAX_PIXELS, exact=False):
+    """Open and decode an image once for all of its graph's analyses.
+
+    Returns (image, original size). Unless exact is set, large JPEGs are
+    decoded at reduced scale through draft(), in the mode their histogram
+    is binned in; other formats are always decoded at full size. High-bit-depth samples are scaled to
+    8 bits (see to_8bit()).
+    """
+    from PIL import Image
+
+    img = Image.open(filepath)
+    original_size = img.size
+    width, height = original_size
+    if not exact and width * height > max_pixels:
+        scale = math.sqrt(max_pixels / (width * height))
+        img.draft(histogram_mode(img)[0], (max(1, int(width * scale)), max(1, int(height * scale))))
+    img.load()
+    scaled = to_8bit(img)
+    if scaled is not img:
+        img.close()
+    return scaled, original_size
+
+
+def image_histograms(img, original_size=None):
+    """256-bin histograms per channel using PIL's native Image.histogram().
+
+    Returns (channel names, counts) where counts has shape (channels, 256).
+    img comes from decode_image(), so it has at most 8 bits per sample. If
+    img was decoded at reduced scale, the counts are rescaled to the
+    pixel count of original_size. PIL bins the pixels natively without any
+    extra copies, so no further downscaling (which would average pixels
+    and distort the histogram) is done here.
+    """
+    mode, channels = histogram_mode(img)
+    if img.mode != mode:
+        img = img.convert(mode)
+
+    counts = np.array(img.histogram(), dtype=np.float64).reshape(len(channels), 256)
+    analysed_pixels = img.size[0] * img.size[1]
+    total_pixels = original_size[0] * original_size[1] if original_size else analysed_pixels
+    if analysed_pixels != total_pixels:
+        counts *= total_pixels / analysed_pixels
+    return channels, counts
+
+
+def render_image_graph(filepath, output_path, exact=False):
+    img, original_size = decode_image(filepath, exact=exact)
+    with img:
+        channels, counts = image_histograms(img, original_size)
+        spectral = image_spectrum(img, original_size)
+
+    with _RENDER_LOCK:
+        fig = new_figure(figsize=(12, 8))
+        all_axes = fig.subplots(2, 3)
+        fig.suptitle('Image Analysis')
+        axes = all_axes[0]
+        edges = np.arange(257)
+
+        if len(channels) == 3:
+            for ax, color, channel_counts in zip(axes, channels, counts):
+                ax.stairs(channel_counts, edges, fill=True, color=color, alpha=0.7)
+                ax.set_title(f'{color.capitalize()} Channel')
+                ax.set_xlabel('Pixel Value')
+                ax.set_ylabel('Frequency')
+        else:
+            axes[1].stairs(counts[0], edges, fill=True, color='gray')
+            axes[1].set_title('Grayscale Histogram')
+            axes[0].axis('off')
+            axes[2].axis('off')
+
+        ax_fft, ax_dct, ax_radial = all_axes[1]
+
+        ax_fft.imshow(spectral['fft_log_magnitude'], cmap='gray')
+        ax_fft.set_title('2D DFT (log magnitude)')
+        ax_fft.axis('off')
+
+        block = spectral['dct_energy'].shape[0]
+        image = ax_dct.imshow(np.log10(spectral['dct_energy'] + 1e-6), cmap='viridis')
+        ax_dct.set_title(f'{block}x{block} Block DCT Energy (log)')
+        ax_dct.set_xlabel('u')
+        ax_dct.set_ylabel('v')
+        fig.colorbar(image, ax=ax_dct)
+
+        ax_radial.loglog(spectral['radial_frequency'][1:], spectral['radial_power'][1:])
+        ax_radial.set_title('Radial Power Spectrum')
+        ax_radial.set_xlabel('Frequency (cycles/pixel)')
+        ax_radial.set_ylabel('Power')
+        ax_radial.grid(True, alpha=0.3)
+
+        fig.tight_layout()
+        fig.savefig(output_path, dpi=100, bbox_inches='tight')
+
+
+def graph_kind(mime_type):
+    if mime_type.startswith('image/'):
+        return 'image'
+    if mime_type.startswith(('audio/', 'video/')):
+        return 'audio'
+    return None
+
+
+def graph_params(kind, exact=False):
+    """Everything that affects how a graph of this kind is rendered."""
+    if kind == 'image':
+        return {
+            'version': GRAPH_VERSION,
+            'exact': exact,
+            'max_pixels': IMAGE_MAX_PIXELS,
+            'fft_max_pixels': FFT_MAX_PIXELS,
+            'block': DCT_BLOCK_SIZE,
+        }
+    return {
+        'version': GRAPH_VERSION,
+        'sample_rate': AUDIO_SAMPLE_RATE,
+        'n_fft': STFT_SIZE,
+        'hop': STFT_HOP,
+        'columns': SPECTROGRAM_COLUMNS,
+    }
+
+
+def render_graph(filepath, kind, output_path, task=None, exact=False):
+    """Render a graph of filepath to output_path; with exact, image
+    histograms count every pixel instead of a draft()-decoded JPEG."""
+    if kind == 'image':
+        render_image_graph(filepath, output_path, exact)
+    else:
+        render_audio_graph(stream_spectrogram(filepath, task=task), output_path)
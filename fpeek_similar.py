@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate image search for fpeek.
+
+Every image below a directory gets a 64-bit DCT perceptual hash
+(fpeek_signal.perceptual_hash), computed in parallel and cached alongside
+the file's other digests. The hashes go into a multi-index Hamming table,
+so looking up all images within a few bits of one checks a handful of
+candidates instead of comparing every pair.
+"""
+
+from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor
+
+from fpeek_cache import get_cache
+from fpeek_trace import span, collect
+from fpeek_common import walk_tree, get_mime_type, imap_bounded, DEFAULT_JOBS
+from fpeek_signal import perceptual_hash, hamming_distance, PHASH_VERSION
+
+# Bits out of 64; resized or recompressed copies usually differ in fewer than 6
+SIMILAR_MAX_DISTANCE = 8
+# Name under which fingerprints are stored in the metadata cache's digests
+PHASH_DIGEST = f'phash-v{PHASH_VERSION}'
+HASH_BITS = 64
+# 16-bit substrings: about one entry per table slot at 65k images
+INDEX_CHUNKS = 4
+
+
+class HammingIndex:
+    """Multi-index hashing over 64-bit hashes.
+
+    Each hash is split into `chunks` substrings, each indexed in its own
+    table. Two hashes within r bits must agree to within r // chunks bits
+    on at least one substring (pigeonhole), so a search only probes those
+    nearby substrings and checks the few candidates they return.
+    """
+
+    def __init__(self, bits=HASH_BITS, chunks=INDEX_CHUNKS):
+        self._chunks = chunks
+        self._width = bits // chunks
+        self._tables = [{} for _ in range(chunks)]
+        self._values = []
+        self._items = []
+        self._flips = {}
+
+    def __len__(self):
+        return len(self._values)
+
+    def _substrings(self, value):
+        mask = (1 << self._width) - 1
+        return [(value >> (i * self._width)) & mask for i in range(self._chunks)]
+
+    def _flip_masks(self, radius):
+        """All substring XOR masks with at most `radius` bits set."""
+        masks = self._flips.get(radius)
+        if masks is None:
+            masks = [
+                sum(1 << bit for bit in bits)
+                for n in range(radius + 1)
+                for bits in combinations(range(self._width), n)
+            ]
+            self._flips[radius] = masks
+        return masks
+
+    def add(self, value, item):
+        index = len(self._values)
+        self._values.append(value)
+        self._items.append(item)
+        for table, key in zip(self._tables, self._substrings(value)):
+            table.setdefault(key, []).append(index)
+
+    def search(self, value, max_distance):
+        """Return (distance, item) pairs within max_distance of value, nearest first."""
+        masks = self._flip_masks(min(max_distance // self._chunks, self._width))
+        seen = set()
+        results = []
+        for table, key in zip(self._tables, self._substrings(value)):
+            for mask in masks:
+                for index in table.get(key ^ mask, ()):
+                    if index in seen:
+                        continue
+                    seen.add(index)
+                    distance = hamming_distance(value, self._values[index])
+                    if distance <= max_distance:
+                        results.append((distance, self._items[index]))
+        results.sort(key=lambda result: result[0])
+        return results
+
+
+def _fingerprint(entry, task=None):
+    """(path, hash) for an image entry, or None for anything else."""
+    if task:
+        task.check()
+    try:
+        stat = entry.stat()
+        if not get_mime_type(entry.path, stat).startswith('image/'):
+            return None
+    except OSError:
+        return None
+
+    cache = get_cache()
+    if cache:
+        cached = (cache.lookup(stat) or {}).get('digests', {}).get(PHASH_DIGEST)
+        if cached is not None:
+            return (entry.path, int(cached, 16)) if cached else None
+
+    with span('phash', stat.st_size):
+        value = perceptual_hash(entry.path)
+    if task:
+        task.add_progress(nbytes=stat.st_size)
+
+    if cache:
+        # An empty digest remembers that the image could not be decoded
+        cache.store(stat, digests={PHASH_DIGEST: f'{value:016x}' if value is not None else ''})
+    return (entry.path, value) if value is not None else None
+
+
+def image_fingerprints(dirpath, jobs=DEFAULT_JOBS, entries=None, task=None):
+    """Yield (path, perceptual hash) for every decodable image below dirpath.
+
+    Decoding runs on `jobs` threads (PIL releases the GIL while it
+    decodes); pass `entries` to fingerprint a pre-filtered list of files.
+    """
+    if entries is None:
+        entries = (entry for entry, is_dir in walk_tree(dirpath, task=task) if not is_dir)
+
+    with ThreadPoolExecutor(max(1, jobs)) as pool:
+        for result in imap_bounded(pool, lambda entry: _fingerprint(entry, task), entries,
+                                   max(1, jobs) * 4):
+            if result is not None:
+                yield result
+
+
+def find_similar_images(dirpath, max_distance=SIMILAR_MAX_DISTANCE, jobs=DEFAULT_JOBS,
+                        task=None, entries=None):
+    """Find groups of visually similar images below dirpath.
+
+    Each group is anchored on one image and holds every not yet grouped
+    image whose perceptual hash is within max_distance bits of it. Returns
+    dicts with the anchor's 'hash', 'paths' (anchor first) and their
+    'distances' to it, largest groups first.
+    """
+    with collect(f"similar {dirpath}"):
+        index = HammingIndex()
+        fingerprints = []
+        for path, value in image_fingerprints(dirpath, jobs, entries, task):
+            index.add(value, path)
+            fingerprints.append((path, value))
+        fingerprints.sort()
+
+        grouped = set()
+        groups = []
+        for path, value in fingerprints:
+            if path in grouped:
+                continue
+            if task:
+                task.check()
+            matches = sorted(
+                (distance, other) for distance, other in index.search(value, max_distance)
+                if other != path and other not in grouped
+            )
+            if not matches:
+                continue
+            grouped.add(path)
+            grouped.update(other for _, other in matches)
+            groups.append({
+                'hash': f'{value:016x}',
+                'paths': [path] + [other for _, other in matches],
+                'distances': [0] + [distance for distance, _ in matches],
+            })
+
+    groups.sort(key=lambda g: (-len(g['paths']), g['paths'][0]))
+    return groups
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Lightweight per-stage timing for fpeek.
+
+Code wraps each stage (stat, MIME detection, ffprobe, hashing, ...) in
+span('stage'). Spans only record anything while tracing is enabled with
+FPEEK_TRACE=1 and a collect() block is active; otherwise span() returns a
+shared no-op object, so the cost is one function call.
+
+Durations go into fixed log-scale buckets, so memory per stage stays
+constant however many files are processed. Set FPEEK_TRACE_LOG=<path> to
+also append every finished collection to a JSON Lines log.
+"""
+
+import os
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+TRACE_ENABLED = os.environ.get('FPEEK_TRACE', '0') not in ('', '0')
+TRACE_LOG = os.environ.get('FPEEK_TRACE_LOG')
+
+# Buckets per power of two: 8 gives about 9% resolution on percentiles
+BUCKETS_PER_OCTAVE = 8
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add_bytes(self, n):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class StageStats:
+    """Count, total/max time, bytes and a duration histogram for one stage."""
+
+    __slots__ = ('count', 'total_ns', 'max_ns', 'bytes', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.bytes = 0
+        self.buckets = {}
+
+    def add(self, elapsed_ns, nbytes):
+        self.count += 1
+        self.total_ns += elapsed_ns
+        self.bytes += nbytes
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        index = int(math.log2(elapsed_ns) * BUCKETS_PER_OCTAVE) if elapsed_ns > 0 else 0
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def percentile(self, q):
+        """Approximate q-th percentile duration in nanoseconds."""
+        if not self.count:
+            return 0
+        rank = q / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # Geometric middle of the bucket, never above the true maximum
+                return min(2 ** ((index + 0.5) / BUCKETS_PER_OCTAVE), self.max_ns)
+        return self.max_ns
+
+    def summary(self):
+        result = {
+            'count': self.count,
+            'total_s': round(self.total_ns / 1e9, 6),
+            'p50_ms': round(self.percentile(50) / 1e6, 3),
+            'p99_ms': round(self.percentile(99) / 1e6, 3),
+            'max_ms': round(self.max_ns / 1e6, 3),
+        }
+        if self.bytes:
+            result['bytes'] = self.bytes
+            if self.total_ns:
+                result['mb_per_s'] = round(self.bytes / (self.total_ns / 1e9) / (1024 * 1024), 2)
+        return result
+
+
+class Stats:
+    """Per-stage statistics gathered during one collect() block.
+
+    Stage times are summed across worker threads, so a stage's total can
+    exceed the wall time of the collection.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, elapsed_ns, nbytes=0):
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+            stats.add(elapsed_ns, nbytes)
+
+    def summary(self):
+        with self._lock:
+            return {
+                'wall_s': round(time.perf_counter() - self.started, 6),
+                'stages': {stage: stats.summary() for stage, stats in sorted(self.stages.items())},
+            }
+
+
+# Replaced as a whole (never mutated) so spans can iterate it without locking
+_active = ()
+_active_lock = threading.Lock()
+
+
+class _Span:
+    __slots__ = ('stage', 'nbytes', 'start')
+
+    def __init__(self, stage, nbytes):
+        self.stage = stage
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter_ns() - self.start
+        for stats in _active:
+            stats.add(self.stage, elapsed, self.nbytes)
+        return False
+
+    def add_bytes(self, n):
+        self.nbytes += n
+
+
+def span(stage, nbytes=0):
+    """Context manager timing one occurrence of `stage`.
+
+    Call add_bytes() on the returned object to attribute bytes processed
+    to the stage once they are known.
+    """
+    if not _active:
+        return _NULL_SPAN
+    return _Span(stage, nbytes)
+
+
+def _write_log(label, summary):
+    record = {'time': datetime.now().isoformat(), 'label': label, **summary}
+    try:
+        with open(TRACE_LOG, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+    except OSError:
+        pass
+
+
+@contextmanager
+def collect(label):
+    """Record spans from all threads while the block runs.
+
+    Yields a Stats object, or None when tracing is disabled. Collections
+    may overlap (two archives at once); each then also sees the other's
+    spans, which is acceptable for a diagnostic aid.
+    """
+    if not TRACE_ENABLED:
+        yield None
+        return
+
+    global _active
+    stats = Stats(label)
+    with _active_lock:
+        _active = _active + (stats,)
+    try:
+        yield stats
+    finally:
+        with _active_lock:
+            _active = tuple(s for s in _active if s is not stats)
+        if TRACE_LOG:
+            _write_log(label, stats.summary())
@@ -52,10 +52,30 @@ EXTENSION_DIR="$HOME/.local/share/nautilus-python/extensions"
 mkdir -p "$EXTENSION_DIR"
 
 cp fpeek_common.py "$EXTENSION_DIR/"
+cp fpeek_cache.py "$EXTENSION_DIR/"
+cp fpeek_mime.py "$EXTENSION_DIR/"
+cp fpeek_trace.py "$EXTENSION_DIR/"
+cp fpeek_index.py "$EXTENSION_DIR/"
 cp fpeek_nautilus.py "$EXTENSION_DIR/"
 cp fpeek_analysis.py "$EXTENSION_DIR/"
+cp fpeek_cli.py "$EXTENSION_DIR/"
+chmod +x "$EXTENSION_DIR/fpeek_cli.py"
+
+# nautilus-python imports every .py file in the extension directory at
+# startup, so the numpy-based modules go next to numpy in the user
+# site-packages and are only loaded when a graph or search needs them
+SITE_DIR="$(python3 -m site --user-site)"
+mkdir -p "$SITE_DIR"
+rm -f "$EXTENSION_DIR/fpeek_signal.py" "$EXTENSION_DIR/fpeek_similar.py"
+cp fpeek_signal.py "$SITE_DIR/"
+cp fpeek_similar.py "$SITE_DIR/"
+
+BIN_DIR="$HOME/.local/bin"
+mkdir -p "$BIN_DIR"
+ln -sf "$EXTENSION_DIR/fpeek_cli.py" "$BIN_DIR/fpeek"
 
 echo "✓ Extension installed!"
+echo "✓ Command-line scanner installed as $BIN_DIR/fpeek"
 echo ""
 echo "Restart Nautilus:"
 echo "  killall nautilus && nautilus &"